@@ -0,0 +1,21 @@
+import re
+
+def parse_tables(sql):
+    """
+    Tabuľky z create_tables.sql: názov -> stĺpce s typmi, primárny kľúč a cudzie kľúče
+    (stĺpec, tabuľka, stĺpec). Zakomentované príkazy (--) sa preskočia.
+    """
+    sql = re.sub(r'--[^\n]*', '', sql)
+    tables = {}
+    for t_name, body in re.findall(r'CREATE TABLE (\w+)\s*\((.*?)\);', sql, flags=re.S|re.I):
+        columns, pk, fks = {}, None, []
+        for line in body.split(','):
+            line = line.strip()
+            m = re.search(r'(\w+)\s+.*PRIMARY KEY', line, re.I)
+            if m: pk = m.group(1)
+            fk = re.search(r'(\w+)\s+\w+.*REFERENCES\s+(\w+)\s*\((\w+)\)', line, re.I)
+            if fk: fks.append(fk.groups())
+            parts = line.split()
+            columns[parts[0]] = parts[1].upper() if len(parts) > 1 else None
+        tables[t_name] = {'columns': columns, 'pk': pk, 'fks': fks}
+    return tables
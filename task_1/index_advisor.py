@@ -0,0 +1,259 @@
+import argparse
+import datetime
+import json
+import random
+import re
+import sqlite3
+import time
+from ddl import parse_tables
+
+# počet vygenerovaných riadkov na tabuľku pri --scale 1 (navyše k sample_data.sql)
+ROWS = {'categories': 20, 'products': 500, 'customers': 2_000, 'orders': 10_000,
+        'order_items': 25_000, 'transactions': 8_000}
+DEFAULT_ROWS = 1_000
+# textové stĺpce s malým počtom hodnôt, ostatné sú unikátne
+VALUES = {
+    'region': ['Bratislava', 'Košice', 'Žilina', 'Nitra', 'Praha', 'Brno', 'Budapest', 'Debrecen'],
+    'order_status': ['completed', 'pending', 'cancelled', 'returned'],
+    'payment_method': ['credit_card', 'bank_transfer', 'cash_on_delivery', 'paypal']
+}
+FIRST_DATE = datetime.date(2022, 1, 1)
+DAYS = 3 * 365
+
+# analytické dopyty s parametrami
+QUERIES = {
+    'revenue_by_region': ("""
+        SELECT c.region, SUM(oi.quantity * oi.unit_price) AS revenue
+        FROM customers c
+        JOIN orders o ON o.customer_id = c.customer_id
+        JOIN order_items oi ON oi.order_id = o.order_id
+        WHERE o.order_status = ?
+        GROUP BY c.region""", ('completed',)),
+    'category_sales': ("""
+        SELECT cat.category_name, SUM(oi.quantity) AS quantity, SUM(oi.quantity * oi.unit_price) AS revenue
+        FROM order_items oi
+        JOIN products p ON p.product_id = oi.product_id
+        JOIN categories cat ON cat.category_id = p.category_id
+        GROUP BY cat.category_name""", ()),
+    'customer_orders': ("""
+        SELECT o.order_id, o.order_date, SUM(oi.quantity * oi.unit_price) AS total
+        FROM orders o
+        JOIN order_items oi ON oi.order_id = o.order_id
+        WHERE o.customer_id = ?
+        GROUP BY o.order_id, o.order_date
+        ORDER BY o.order_date""", (42,)),
+    'order_detail': ("""
+        SELECT p.name, oi.quantity, oi.unit_price
+        FROM order_items oi
+        JOIN products p ON p.product_id = oi.product_id
+        WHERE oi.order_id = ?""", (4242,)),
+    'product_customers': ("""
+        SELECT DISTINCT c.customer_id, c.email
+        FROM order_items oi
+        JOIN orders o ON o.order_id = oi.order_id
+        JOIN customers c ON c.customer_id = o.customer_id
+        WHERE oi.product_id = ?""", (7,)),
+    'region_customer_orders': ("""
+        SELECT c.customer_id, COUNT(o.order_id) AS orders
+        FROM customers c
+        LEFT JOIN orders o ON o.customer_id = c.customer_id
+        WHERE c.region = ?
+        GROUP BY c.customer_id""", ('Bratislava',)),
+    'unpaid_orders': ("""
+        SELECT o.order_id, o.order_date
+        FROM orders o
+        LEFT JOIN transactions t ON t.order_id = o.order_id
+        WHERE t.transaction_id IS NULL AND o.order_status = ?""", ('completed',)),
+    'category_products': ("""
+        SELECT p.product_id, p.name, p.price
+        FROM products p
+        WHERE p.category_id = ?""", (3,))
+}
+
+# -----------------------------
+# 1. Databáza so zväčšenými dátami
+# -----------------------------
+def insert_order(tables):
+    # rodičovské tabuľky pred tabuľkami, ktoré na ne odkazujú
+    order, visiting = [], set()
+    def visit(name):
+        if name in order or name in visiting or name not in tables:
+            return
+        visiting.add(name)
+        for _, ref_table, _ in tables[name]['fks']:
+            visit(ref_table)
+        order.append(name)
+    for name in tables:
+        visit(name)
+    return order
+
+def value(rng, col, col_type, fk_max):
+    if col in fk_max:
+        return rng.randint(1, fk_max[col])
+    if col in VALUES:
+        return rng.choice(VALUES[col])
+    if col_type == 'DATE':
+        return (FIRST_DATE + datetime.timedelta(days=rng.randrange(DAYS))).isoformat()
+    if col_type == 'DECIMAL':
+        return round(rng.uniform(1, 100), 2)
+    if col_type == 'BOOLEAN':
+        return rng.random() < 0.9
+    if col_type == 'INTEGER':
+        return rng.randint(1, 10)
+    return None
+
+def generate_rows(con, name, table, n, rng):
+    start = con.execute(f"SELECT COALESCE(MAX({table['pk']}), 0) FROM {name}").fetchone()[0] + 1
+    fk_max = {col: con.execute(f"SELECT MAX({ref_col}) FROM {ref_table}").fetchone()[0] or 1
+              for col, ref_table, ref_col in table['fks']}
+    rows = []
+    for i in range(start, start + n):
+        rows.append([i if col == table['pk'] else
+                     f"{col}_{i}" if col_type == 'VARCHAR' and col not in VALUES else
+                     value(rng, col, col_type, fk_max)
+                     for col, col_type in table['columns'].items()])
+    con.executemany(f"INSERT INTO {name} VALUES ({', '.join('?' * len(table['columns']))})", rows)
+
+def build_database(schema_sql, sample_sql, scale=1.0, seed=0):
+    """SQLite v pamäti so schémou z create_tables.sql, ukážkovými dátami a riadkami podľa ROWS * scale."""
+    tables = parse_tables(schema_sql)
+    con = sqlite3.connect(":memory:")
+    con.executescript(schema_sql)
+    con.executescript(sample_sql)
+    rng = random.Random(seed)
+    for name in insert_order(tables):
+        generate_rows(con, name, tables[name], int(ROWS.get(name, DEFAULT_ROWS) * scale), rng)
+    con.commit()
+    con.execute("ANALYZE")
+    return con, tables
+
+# -----------------------------
+# 2. EXPLAIN QUERY PLAN
+# -----------------------------
+def query_plan(con, sql, params):
+    return [row[3] for row in con.execute("EXPLAIN QUERY PLAN " + sql, params)]
+
+def plan_step(detail):
+    """(SCAN/SEARCH, alias, index alebo None, automatický index) z riadku plánu."""
+    m = re.match(r'(SCAN|SEARCH) (\w+)(?: AS (\w+))?(?: USING (AUTOMATIC )?(?:COVERING |PARTIAL )*INDEX(?: (\w+))?)?', detail)
+    if m is None:
+        return None
+    op, table, alias, automatic, index = m.groups()
+    return op, alias or table, index, automatic is not None
+
+def query_aliases(sql):
+    # alias -> tabuľka z FROM a JOIN
+    aliases = {}
+    for table, alias in re.findall(r'(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?', sql, re.I):
+        if alias.upper() in ('', 'ON', 'WHERE', 'JOIN', 'LEFT', 'INNER', 'GROUP', 'ORDER'):
+            alias = table
+        aliases[alias] = table
+    return aliases
+
+def fk_candidates(sql, tables):
+    """Cudzie kľúče, podľa ktorých dopyt spája alebo filtruje (alias.stĺpec v dopyte): (alias, tabuľka, stĺpec)."""
+    found = []
+    for alias, table in query_aliases(sql).items():
+        for col, _, _ in tables.get(table, {}).get('fks', []):
+            if re.search(rf'\b{alias}\.{col}\b', sql):
+                found.append((alias, table, col))
+    return found
+
+def index_name(table, col):
+    return f"idx_{table}_{col}"
+
+def is_full_scan(step):
+    # prehľadanie celej tabuľky alebo index, ktorý si SQLite musí postaviť pri každom dopyte
+    return step is not None and ((step[0] == 'SCAN' and step[2] is None) or step[3])
+
+# -----------------------------
+# 3. Benchmark
+# -----------------------------
+def run_query(con, sql, params, repeat):
+    best, rows = float('inf'), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = con.execute(sql, params).fetchall()
+        best = min(best, time.perf_counter() - start)
+    return best, sorted(tuple(round(v, 6) if isinstance(v, float) else v for v in row) for row in rows)
+
+def advise(con, tables, queries=QUERIES, repeat=5):
+    """
+    Pre každý dopyt zmeria čas a plán bez indexov na cudzích kľúčoch, potom vytvorí indexy
+    na všetkých cudzích kľúčoch, ktoré dopyty používajú, a ponechá len tie, ktoré plánovač
+    skutočne zvolí. Označí prehľadania celých tabuliek, ktoré tieto indexy nahradia,
+    zmeria dopyty znova a overí, že výsledky sú rovnaké.
+    """
+    report = {}
+    for name, (sql, params) in queries.items():
+        seconds, rows = run_query(con, sql, params, repeat)
+        report[name] = {'plan_before': query_plan(con, sql, params), 'ms_before': seconds * 1000, '_rows': rows}
+
+    candidates = {(table, col) for sql, _ in queries.values() for _, table, col in fk_candidates(sql, tables)}
+    for table, col in sorted(candidates):
+        con.execute(f"CREATE INDEX IF NOT EXISTS {index_name(table, col)} ON {table}({col})")
+    con.execute("ANALYZE")
+    used = {step[2] for sql, params in queries.values()
+            for step in map(plan_step, query_plan(con, sql, params)) if step is not None and step[2]}
+    recommended = sorted((table, col) for table, col in candidates if index_name(table, col) in used)
+    for table, col in candidates - set(recommended):
+        con.execute(f"DROP INDEX {index_name(table, col)}")
+    con.execute("ANALYZE")
+
+    for name, (sql, params) in queries.items():
+        entry = report[name]
+        entry['plan_after'] = query_plan(con, sql, params)
+        seconds, rows = run_query(con, sql, params, repeat)
+        entry['ms_after'] = seconds * 1000
+        entry['same_result'] = rows == entry.pop('_rows')
+
+        after = {step[1]: step for step in map(plan_step, entry['plan_after']) if step is not None}
+        entry['full_scans'] = []
+        entry['indexes'] = []
+        for detail in entry['plan_before']:
+            step = plan_step(detail)
+            if not is_full_scan(step):
+                continue
+            fixed = after.get(step[1])
+            fixed = fixed if fixed is not None and not is_full_scan(fixed) and fixed[2] in used else None
+            entry['full_scans'].append({'before': detail, 'after': next(
+                (d for d in entry['plan_after'] if fixed is not None and plan_step(d) == fixed), None)})
+            if fixed is not None and fixed[2] not in entry['indexes']:
+                entry['indexes'].append(fixed[2])
+
+    return {
+        'queries': report,
+        'recommended_indexes': [f"CREATE INDEX {index_name(table, col)} ON {table}({col});" for table, col in recommended]
+    }
+
+def print_report(result):
+    print(f"{'dopyt':<26}{'pred ms':>10}{'po ms':>10}{'zrýchlenie':>12}  výsledok")
+    for name, entry in result['queries'].items():
+        speedup = entry['ms_before'] / max(entry['ms_after'], 1e-6)
+        print(f"{name:<26}{entry['ms_before']:>10.2f}{entry['ms_after']:>10.2f}{speedup:>11.1f}x  "
+              f"{'rovnaký' if entry['same_result'] else 'ROZDIELNY'}")
+        for scan in entry['full_scans']:
+            if scan['after'] is not None:
+                print(f"  ! {scan['before']}  ->  {scan['after']}")
+            else:
+                print(f"    {scan['before']}  (bez zmeny, dopyt číta celú tabuľku)")
+    print("\nOdporúčané indexy:")
+    for ddl in result['recommended_indexes'] or ["(žiadne)"]:
+        print(f"  {ddl}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="EXPLAIN QUERY PLAN a benchmark indexov na cudzích kľúčoch v SQLite.")
+    parser.add_argument("--schema", default="create_tables.sql")
+    parser.add_argument("--sample", default="sample_data.sql")
+    parser.add_argument("--scale", type=float, default=10, help="násobok počtov riadkov v ROWS")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5, help="behy dopytu, berie sa najrýchlejší")
+    parser.add_argument("--report", help="uloží výsledok aj ako JSON")
+    args = parser.parse_args()
+
+    con, tables = build_database(open(args.schema).read(), open(args.sample).read(), args.scale, args.seed)
+    result = advise(con, tables, QUERIES, args.repeat)
+    print_report(result)
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
@@ -0,0 +1,207 @@
+import argparse
+import datetime
+import json
+import random
+import sqlite3
+import time
+from ddl import parse_tables
+from index_advisor import ROWS, FIRST_DATE, generate_rows, index_name
+
+# dimenzie, ktoré sa počas simulácie nemenia
+DIMENSIONS = ['categories', 'products', 'customers']
+# indexy, ktoré inkrementálna transformácia potrebuje na čítanie len posledných dní
+INDEXES = [('orders', 'order_date'), ('order_items', 'order_id')]
+MART_STATUS = 'completed'
+# tržby sa porovnávajú zaokrúhlené, poradie sčítania sa v oboch trhoch môže líšiť
+PRECISION = 6
+
+MART_DDL = """
+    CREATE TABLE {mart} (
+        sale_date DATE,
+        product_id INTEGER,
+        orders INTEGER,
+        quantity INTEGER,
+        revenue DECIMAL,
+        PRIMARY KEY (sale_date, product_id)
+    )"""
+
+# denné predaje produktov z dokončených objednávok
+SOURCE_SQL = """
+    SELECT o.order_date AS sale_date, oi.product_id, COUNT(DISTINCT o.order_id) AS orders,
+           SUM(oi.quantity) AS quantity, SUM(oi.quantity * oi.unit_price) AS revenue
+    FROM orders o
+    JOIN order_items oi ON oi.order_id = o.order_id
+    WHERE o.order_status = '{status}'{window}
+    GROUP BY o.order_date, oi.product_id"""
+
+FULL_REBUILD_SQL = [
+    "DELETE FROM {mart}",
+    "INSERT INTO {mart} " + SOURCE_SQL.format(status=MART_STATUS, window="")
+]
+
+# MERGE: zdroj okna sa spočíta raz, potom WHEN MATCHED AND zmenené THEN UPDATE,
+# WHEN NOT MATCHED THEN INSERT a WHEN NOT MATCHED BY SOURCE (v okne) THEN DELETE
+MERGE_SQL = [
+    "DROP TABLE IF EXISTS temp.{mart}_source",
+    "CREATE TEMP TABLE {mart}_source AS " + SOURCE_SQL.format(status=MART_STATUS, window=" AND o.order_date >= :start"),
+    """INSERT INTO {mart} SELECT * FROM temp.{mart}_source WHERE true
+    ON CONFLICT (sale_date, product_id) DO UPDATE SET
+        orders = excluded.orders, quantity = excluded.quantity, revenue = excluded.revenue
+    WHERE orders != excluded.orders OR quantity != excluded.quantity OR revenue != excluded.revenue""",
+    """DELETE FROM {mart}
+    WHERE sale_date >= :start
+      AND (sale_date, product_id) NOT IN (SELECT sale_date, product_id FROM temp.{mart}_source)""",
+    "DROP TABLE temp.{mart}_source"
+]
+
+# -----------------------------
+# 1. Simulácia denného prírastku
+# -----------------------------
+def build_database(schema_sql, sample_sql, seed=0, db=":memory:"):
+    """SQLite so schémou z create_tables.sql, ukážkovými dátami, dimenziami podľa ROWS a indexmi z INDEXES."""
+    tables = parse_tables(schema_sql)
+    con = sqlite3.connect(db)
+    con.executescript(schema_sql)
+    con.executescript(sample_sql)
+    rng = random.Random(seed)
+    for name in DIMENSIONS:
+        generate_rows(con, name, tables[name], ROWS[name], rng)
+    for table, col in INDEXES:
+        con.execute(f"CREATE INDEX {index_name(table, col)} ON {table}({col})")
+    con.commit()
+    return con
+
+def settle_orders(con, day, rng, lookback, return_rate):
+    """
+    Zmeny starších objednávok, ktoré plain INSERT nepokryje: čakajúce objednávky sa na druhý
+    deň dokončia alebo zrušia a časť dokončených za posledných lookback dní sa vráti.
+    """
+    since = (day - datetime.timedelta(days=lookback)).isoformat()
+    pending = con.execute("SELECT order_id FROM orders WHERE order_status = 'pending' AND order_date >= ?",
+                          (since,)).fetchall()
+    updates = [(rng.choice(['completed'] * 9 + ['cancelled']), order_id) for order_id, in pending]
+    completed = con.execute("SELECT order_id FROM orders WHERE order_status = 'completed' AND order_date >= ?",
+                            (since,)).fetchall()
+    updates += [('returned', order_id) for order_id, in completed if rng.random() < return_rate]
+    con.executemany("UPDATE orders SET order_status = ? WHERE order_id = ?", updates)
+    return len(updates)
+
+def add_orders(con, day, rng, orders_per_day, max_items):
+    """Objednávky jedného dňa s 1 až max_items položkami za cenu produktu."""
+    order_id = con.execute("SELECT COALESCE(MAX(order_id), 0) FROM orders").fetchone()[0] + 1
+    item_id = con.execute("SELECT COALESCE(MAX(order_item_id), 0) FROM order_items").fetchone()[0] + 1
+    customers = con.execute("SELECT MAX(customer_id) FROM customers").fetchone()[0]
+    prices = con.execute("SELECT product_id, price FROM products").fetchall()
+    orders, items = [], []
+    for o in range(order_id, order_id + orders_per_day):
+        orders.append((o, rng.randint(1, customers), day.isoformat(), 'pending' if rng.random() < 0.2 else 'completed'))
+        for product_id, price in rng.sample(prices, rng.randint(1, max_items)):
+            items.append((item_id, o, product_id, rng.randint(1, 5), price))
+            item_id += 1
+    con.executemany("INSERT INTO orders VALUES (?, ?, ?, ?)", orders)
+    con.executemany("INSERT INTO order_items VALUES (?, ?, ?, ?, ?)", items)
+
+def simulate_day(con, day, rng, orders_per_day=500, max_items=5, lookback=3, return_rate=0.02):
+    changed = settle_orders(con, day, rng, lookback, return_rate)
+    add_orders(con, day, rng, orders_per_day, max_items)
+    con.commit()
+    return changed
+
+# -----------------------------
+# 2. Transformácie do dátového trhu
+# -----------------------------
+def run_statements(con, statements, mart, params=None):
+    start = time.perf_counter()
+    with con:
+        for sql in statements:
+            con.execute(sql.format(mart=mart), params or {})
+    return time.perf_counter() - start
+
+def full_rebuild(con, mart="daily_sales_full"):
+    """Celý trh odznova z celej histórie objednávok."""
+    return run_statements(con, FULL_REBUILD_SQL, mart)
+
+def merge_window_start(con, day, lookback, last_order_id):
+    # posledných lookback dní (zmeny stavu) a dátumy objednávok pribudnutých od posledného behu
+    new = con.execute("SELECT MIN(order_date) FROM orders WHERE order_id > ?", (last_order_id,)).fetchone()[0]
+    start = (day - datetime.timedelta(days=lookback)).isoformat()
+    return min(start, new) if new else start
+
+def incremental_merge(con, start, mart="daily_sales_incremental"):
+    """Upsert (INSERT ... ON CONFLICT DO UPDATE, ekvivalent MERGE) len pre dni od start."""
+    return run_statements(con, MERGE_SQL, mart, {'start': start})
+
+def mart_rows(con, mart):
+    return sorted(tuple(round(v, PRECISION) if isinstance(v, float) else v for v in row)
+                  for row in con.execute(f"SELECT * FROM {mart}"))
+
+# -----------------------------
+# 3. Benchmark
+# -----------------------------
+def run_benchmark(con, days=30, history_days=365, first_day=FIRST_DATE, seed=0, orders_per_day=500,
+                  max_items=5, lookback=3, return_rate=0.02, verify=True):
+    """
+    Naplní history_days dní histórie a postaví oba trhy, potom každý simulovaný deň pridá
+    objednávky, zmení stav starších a zmeria prestavbu celého trhu aj inkrementálny MERGE.
+    Pri verify overí, že oba trhy sú po každom dni rovnaké.
+    """
+    rng = random.Random(seed)
+    day = first_day
+    for _ in range(history_days):
+        simulate_day(con, day, rng, orders_per_day, max_items, lookback, return_rate)
+        day += datetime.timedelta(days=1)
+    for mart in ("daily_sales_full", "daily_sales_incremental"):
+        con.execute(MART_DDL.format(mart=mart))
+    con.execute("ANALYZE")
+    full_rebuild(con)
+    full_rebuild(con, "daily_sales_incremental")
+    last_order_id = con.execute("SELECT MAX(order_id) FROM orders").fetchone()[0]
+
+    report = []
+    for _ in range(days):
+        changed = simulate_day(con, day, rng, orders_per_day, max_items, lookback, return_rate)
+        start = merge_window_start(con, day, lookback, last_order_id)
+        entry = {
+            'day': day.isoformat(),
+            'order_items': con.execute("SELECT COUNT(*) FROM order_items").fetchone()[0],
+            'changed_orders': changed,
+            'window_start': start,
+            'full_ms': full_rebuild(con) * 1000,
+            'merge_ms': incremental_merge(con, start) * 1000
+        }
+        if verify:
+            entry['same_result'] = mart_rows(con, "daily_sales_full") == mart_rows(con, "daily_sales_incremental")
+        report.append(entry)
+        last_order_id = con.execute("SELECT MAX(order_id) FROM orders").fetchone()[0]
+        day += datetime.timedelta(days=1)
+    return report
+
+def print_report(report):
+    print(f"{'deň':<12}{'položky':>10}{'zmeny':>8}{'prestavba ms':>14}{'MERGE ms':>10}{'zrýchlenie':>12}  výsledok")
+    for entry in report:
+        speedup = entry['full_ms'] / max(entry['merge_ms'], 1e-6)
+        same = {True: 'rovnaký', False: 'ROZDIELNY'}.get(entry.get('same_result'), '-')
+        print(f"{entry['day']:<12}{entry['order_items']:>10}{entry['changed_orders']:>8}{entry['full_ms']:>14.1f}"
+              f"{entry['merge_ms']:>10.1f}{speedup:>11.1f}x  {same}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Denný dátový trh predajov: prestavba celého trhu vs. inkrementálny MERGE v SQLite.")
+    parser.add_argument("--schema", default="create_tables.sql")
+    parser.add_argument("--sample", default="sample_data.sql")
+    parser.add_argument("--db", default=":memory:", help="súbor databázy (predvolene v pamäti)")
+    parser.add_argument("--days", type=int, default=30, help="merané simulované dni")
+    parser.add_argument("--history-days", type=int, default=365, help="dni histórie pred meraním")
+    parser.add_argument("--orders-per-day", type=int, default=500)
+    parser.add_argument("--lookback", type=int, default=3, help="dni, v ktorých sa objednávky ešte menia")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-verify", action="store_true", help="neporovnávať trhy po každom dni")
+    parser.add_argument("--report", help="uloží výsledok aj ako JSON")
+    args = parser.parse_args()
+
+    con = build_database(open(args.schema).read(), open(args.sample).read(), args.seed, args.db)
+    report = run_benchmark(con, args.days, args.history_days, seed=args.seed, orders_per_day=args.orders_per_day,
+                           lookback=args.lookback, verify=not args.no_verify)
+    print_report(report)
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
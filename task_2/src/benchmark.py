@@ -0,0 +1,184 @@
+# benchmark.py
+import polars as pl
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import time
+from instrumentation import measure, start_run, active_run, finish_run
+from postal_codes import load_postal_codes
+from output_writer import OutputWriter
+from synthetic_data import generate, write_postal_fixture
+import etl_analysis as etl
+
+# -----------------------------
+# 1. Tasks
+# -----------------------------
+def _run_tasks(orders_path: str, items_path: str, postal_urls: dict, work_dir: str, writer: OutputWriter,
+               lazy: bool, pairs_approximate: bool, n_new_stores: int, memory_budget_mb: float | None,
+               shard_by: str | None, n_shards: int):
+    with measure("load_postal_codes", active_run().tasks) as record:
+        postal_df = load_postal_codes(postal_urls, os.path.join(work_dir, "postal_cache"), offline=False)
+        record['rows_out'] = postal_df.height
+
+    if memory_budget_mb:
+        etl.run_streaming_pipeline.fn(orders_path, items_path, postal_df, writer, memory_budget_mb)
+        return
+    if shard_by:
+        etl.run_sharded_pipeline.fn(orders_path, items_path, postal_df, writer, shard_by, n_shards)
+        return
+    if lazy:
+        etl.run_lazy_pipeline.fn(orders_path, items_path, postal_df, writer, pairs_approximate=pairs_approximate)
+        return
+
+    orders, items = etl.load_clean_orders_items.fn(orders_path, items_path, writer)
+    lines = etl.build_order_lines.fn(orders, items)
+    orders = etl.calculate_order_values.fn(orders, lines)
+    orders = etl.enrich_orders_with_cities.fn(orders, postal_df, writer)
+
+    # the analyses only read the frames above, a failure doesn't stop the others
+    analyses = [
+        lambda: etl.daily_city_cube.fn(orders, writer),
+        lambda: etl.top_5_store_candidates.fn(orders, writer),
+        lambda: etl.top_10_product_pairs.fn(lines, writer, approximate=pairs_approximate),
+        lambda: etl.monthly_product_margin.fn(lines, writer),
+        lambda: etl.product_margin_rollups.fn(lines, writer)
+    ]
+    if n_new_stores:
+        analyses.append(lambda: etl.new_store_locations.fn(orders, postal_df, writer, n_new_stores))
+    for analysis in analyses:
+        try:
+            analysis()
+        except Exception:
+            pass
+
+def run_tasks(orders_path: str, items_path: str, postal_urls: dict, work_dir: str,
+              lazy: bool = False, pairs_approximate: bool = False, n_new_stores: int = 5,
+              memory_budget_mb: float | None = None, shard_by: str | None = None, n_shards: int = 4) -> list:
+    """
+    Runs the flow's tasks one after another (their plain functions, without the Prefect
+    engine) and returns their instrumentation records. A failed task is recorded with
+    its error and stops the tasks that depend on it.
+    """
+    run = start_run()
+    try:
+        _run_tasks(orders_path, items_path, postal_urls, work_dir, OutputWriter(os.path.join(work_dir, "out")),
+                   lazy, pairs_approximate, n_new_stores, memory_budget_mb, shard_by, n_shards)
+    except Exception:
+        pass
+    finally:
+        finish_run(work_dir, "completed")
+    return run.tasks
+
+# -----------------------------
+# 2. Report and baseline comparison
+# -----------------------------
+def environment() -> dict:
+    return {
+        'python': platform.python_version(),
+        'polars': pl.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count()
+    }
+
+def compare(report: dict, baseline: dict, tolerance: float = 0.25,
+            min_wall_s: float = 0.05, min_rss_mb: float = 20) -> list:
+    """
+    Tasks (matched by scale and name) that got slower or used more memory than the
+    baseline by more than `tolerance`; differences below min_wall_s / min_rss_mb are noise.
+    """
+    base = {(run['lines'], s['task']): s for run in baseline['runs'] for s in run['tasks']}
+    regressions = []
+    for run in report['runs']:
+        for s in run['tasks']:
+            b = base.get((run['lines'], s['task']))
+            if b is None or b.get('status') != 'ok':
+                continue
+            if s['status'] != 'ok':
+                regressions.append({'lines': run['lines'], 'task': s['task'], 'metric': 'status',
+                                    'baseline': 'ok', 'current': s['status']})
+                continue
+            for metric, floor in [('wall_s', min_wall_s), ('peak_rss_delta_mb', min_rss_mb)]:
+                if s[metric] > b[metric] * (1 + tolerance) and s[metric] - b[metric] > floor:
+                    regressions.append({'lines': run['lines'], 'task': s['task'], 'metric': metric,
+                                        'baseline': b[metric], 'current': s[metric],
+                                        'ratio': round(s[metric] / max(b[metric], 1e-9), 2)})
+    return regressions
+
+def print_report(report: dict):
+    for run in report['runs']:
+        print(f"\n{run['lines']:,} lines / {run['orders']:,} orders")
+        print(f"  {'task':<28}{'wall s':>10}{'cpu s':>10}{'peak MB':>10}{'+MB':>8}{'rows':>12}{'MB out':>9}")
+        for s in run['tasks']:
+            rows = f"{s['rows_out']:,}" if s['status'] == 'ok' and s['rows_out'] is not None else s['status']
+            print(f"  {s['task']:<28}{s['wall_s']:>10.3f}{s['cpu_s']:>10.3f}{s['peak_rss_mb']:>10.1f}"
+                  f"{s['peak_rss_delta_mb']:>8.1f}{rows:>12}{s['bytes_written'] / 2**20:>9.1f}")
+
+def run_benchmark(scales: list, data_dir: str = "../data/bench", seed: int = 0, lazy: bool = False,
+                  pairs_approximate: bool = False, n_new_stores: int = 5, memory_budget_mb: float | None = None,
+                  shard_by: str | None = None, n_shards: int = 4) -> dict:
+    """
+    Generates (or reuses) a synthetic data set per scale and measures every task on it.
+    The postal codes come from a local fixture instead of the GitHub download.
+    """
+    postal_urls = write_postal_fixture(os.path.join(data_dir, "postal_fixture"), seed)
+    report = {
+        'generated_at': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'environment': environment(),
+        'config': {'seed': seed, 'lazy': lazy, 'pairs_approximate': pairs_approximate, 'n_new_stores': n_new_stores,
+                   'memory_budget_mb': memory_budget_mb, 'shard_by': shard_by, 'n_shards': n_shards},
+        'runs': []
+    }
+    for lines in scales:
+        input_dir = os.path.join(data_dir, f"input-{lines}-{seed}")
+        orders_path = os.path.join(input_dir, "sales_order.csv")
+        items_path = os.path.join(input_dir, "sales_order_item.csv")
+        if not (os.path.exists(orders_path) and os.path.exists(items_path)):
+            generate(input_dir, lines, seed=seed)
+
+        work_dir = os.path.join(data_dir, f"run-{lines}")
+        shutil.rmtree(work_dir, ignore_errors=True)
+        tasks = run_tasks(orders_path, items_path, postal_urls, work_dir, lazy, pairs_approximate, n_new_stores,
+                          memory_budget_mb, shard_by, n_shards)
+        report['runs'].append({
+            'lines': lines,
+            'orders': pl.scan_csv(orders_path).select(pl.len()).collect().item(),
+            'input_mb': round((os.path.getsize(orders_path) + os.path.getsize(items_path)) / 2**20, 1),
+            'tasks': tasks
+        })
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scaling benchmark of the ETL tasks on synthetic data.")
+    parser.add_argument("--lines", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", default="../data/bench")
+    parser.add_argument("--lazy", action="store_true", help="measure the single lazy plan instead of the eager tasks")
+    parser.add_argument("--pairs-approximate", action="store_true")
+    parser.add_argument("--new-stores", type=int, default=5)
+    parser.add_argument("--memory-budget-mb", type=float, help="measure the bounded-memory streaming mode")
+    parser.add_argument("--shard-by", choices=["country", "hash"], help="measure the sharded mode")
+    parser.add_argument("--shards", type=int, default=4, help="hash partitions with --shard-by hash")
+    parser.add_argument("--report", default="../data/bench/report.json")
+    parser.add_argument("--baseline", help="earlier report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    report = run_benchmark(args.lines, args.data_dir, args.seed, args.lazy, args.pairs_approximate, args.new_stores,
+                           args.memory_budget_mb, args.shard_by, args.shards)
+    print_report(report)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            report['regressions'] = compare(report, json.load(f), args.tolerance)
+        for r in report['regressions']:
+            print(f"REGRESSION {r['lines']:,} lines {r['task']} {r['metric']}: {r['baseline']} -> {r['current']}")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.report)), exist_ok=True)
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nReport written to {args.report}")
+    sys.exit(1 if report.get('regressions') else 0)
@@ -1,7 +1,12 @@
 import streamlit as st
 import pandas as pd
 import plotly.express as px
+import numpy as np
+import polars as pl
 import os
+import json
+from output_writer import scan_output, output_version
+from instrumentation import METRICS_FILE
 
 # -----------------------------
 # 1. Page configuration
@@ -45,18 +50,160 @@ st.markdown("""
 # -----------------------------
 # 3. Load data
 # -----------------------------
+# most points the orders map draws; the automatic resolution is the finest one that stays below
+MAX_MAP_POINTS = 1500
+# margin rollup grains offered in the product analysis, with their axis tick format
+GRAIN_TICKS = {'day': "%Y-%m-%d", 'week': "%Y-%m-%d", 'month': "%Y-%m", 'quarter': "%Y-%m"}
+
 BASE_DIR = os.path.dirname(os.path.dirname(__file__))  # /workspaces/GymBeam/task_2
 DATA_DIR = os.path.join(BASE_DIR, "data", "out")
 
-@st.cache_data
-def load_data():
-    orders = pd.read_csv(os.path.join(DATA_DIR, "orders_enriched.csv"), parse_dates=['created_at'])
-    items = pd.read_csv(os.path.join(DATA_DIR, "items_cleaned.csv"))
-    top5 = pd.read_csv(os.path.join(DATA_DIR, "top_5_city_recommendations.csv"))
-    monthly_margin_df = pd.read_csv(os.path.join(DATA_DIR, "monthly_product_margin.csv"), parse_dates=['year_month'])
-    top_pairs_df = pd.read_csv(os.path.join(DATA_DIR, "top_10_product_pairs.csv"))
-    return orders, items, top5, monthly_margin_df, top_pairs_df
-orders, items, top5, monthly_margin_df, top_pairs_df = load_data()
+def read_output(name):
+    # columnar ETL outputs (via manifest.json), or the plain CSVs of older runs
+    lf = scan_output(DATA_DIR, name)
+    return None if lf is None else lf.collect()
+
+def missing_output(name):
+    # a section without its output (e.g. written by an older or partial ETL run) is skipped, not the page
+    st.info(f"No '{name}' output in {DATA_DIR} yet, run etl_analysis.py to fill this section.")
+
+@st.cache_resource
+def output_cache():
+    # name -> (version, frame), one copy shared by all sessions
+    return {}
+
+def load_output(name):
+    """
+    An ETL output as a Polars frame, read when a section first needs it and read again
+    once the ETL has rewritten it (its version in manifest.json changed). None while the
+    ETL hasn't written it.
+    """
+    cache, version = output_cache(), output_version(DATA_DIR, name)
+    if name not in cache or cache[name][0] != version:
+        cache[name] = (version, read_output(name))
+    return cache[name][1]
+
+# the derived structures below are cached per version of their outputs; max_entries=1
+# drops the structure of the previous ETL run when a new one appears
+@st.cache_resource(max_entries=1)
+def load_city_cube(version):
+    """
+    Prefix sums over the ETL's daily x location cube: row d holds the totals of all days
+    before d for every (place_name, latitude, longitude), so any date range is two row lookups.
+    """
+    cube = scan_output(DATA_DIR, "daily_city_sales")
+    if cube is None:
+        # outputs of an older ETL run, build the cube from the orders once
+        orders = scan_output(DATA_DIR, "orders_enriched")
+        if orders is None:
+            return None
+        cube = orders.group_by([
+            pl.col('created_at').dt.date().alias('date'), 'place_name', 'latitude', 'longitude'
+        ]).agg([
+            pl.len().alias('order_count'),
+            pl.sum('order_value').alias('order_value_sum'),
+            pl.col('order_value').count().alias('order_value_count')
+        ])
+    cube = cube.collect()
+
+    keys = cube.select(['place_name', 'latitude', 'longitude']).unique(maintain_order=True).with_row_index('key')
+    cube = cube.join(keys, on=['place_name', 'latitude', 'longitude'], how='left', nulls_equal=True)
+    first_day, last_day = cube['date'].min(), cube['date'].max()
+    day = (cube['date'] - first_day).dt.total_days().to_numpy()
+    key = cube['key'].to_numpy()
+
+    prefix = {}
+    for col in ['order_count', 'order_value_sum', 'order_value_count']:
+        totals = np.zeros(((last_day - first_day).days + 2, keys.height))
+        np.add.at(totals, (day + 1, key), cube[col].fill_null(0).to_numpy())
+        prefix[col] = totals.cumsum(axis=0)
+
+    keys = keys.drop('key').to_pandas()
+    place_codes, place_names = pd.factorize(keys['place_name'])
+    return first_day, last_day, keys, place_codes, place_names, prefix
+
+def query_city_cube(start, end):
+    """Per-location order count, order value sum and count of valued orders between start and end (inclusive)."""
+    first_day, last_day, keys, place_codes, place_names, prefix = city_cube
+    lo = min(max((start - first_day).days, 0), (last_day - first_day).days + 1)
+    hi = min(max((end - first_day).days + 1, 0), (last_day - first_day).days + 1)
+    return {col: totals[max(hi, lo)] - totals[lo] for col, totals in prefix.items()}
+
+cube_version = output_version(DATA_DIR, "daily_city_sales") or output_version(DATA_DIR, "orders_enriched")
+city_cube = load_city_cube(cube_version)
+if city_cube is None:
+    # every section reads the date range and locations of the cube
+    st.error(f"No ETL outputs in {DATA_DIR}, run etl_analysis.py first")
+    st.stop()
+
+@st.cache_resource(max_entries=1)
+def load_location_bins(version):
+    """
+    Map bins precomputed by the ETL, aligned with the cube's locations: per resolution the
+    bin of every location (-1 without coordinates) and the bin centres.
+    """
+    bins = scan_output(DATA_DIR, "location_bins")
+    if bins is None:
+        return None
+    keys = pl.from_pandas(city_cube[2]).with_row_index('key')
+    bins = keys.join(bins.collect(), on=['place_name', 'latitude', 'longitude'], how='inner')
+    map_bins = {}
+    for (km,), part in sorted(bins.partition_by('resolution_km', as_dict=True).items()):
+        centres = part.select(['bin_latitude', 'bin_longitude']).unique(maintain_order=True).with_row_index('bin')
+        part = part.join(centres, on=['bin_latitude', 'bin_longitude'], how='left')
+        codes = np.full(keys.height, -1, dtype=np.int64)
+        codes[part['key'].to_numpy()] = part['bin'].to_numpy()
+        map_bins[km] = (codes, centres['bin_latitude'].to_numpy(), centres['bin_longitude'].to_numpy())
+    return map_bins
+
+def binned_orders(km):
+    """Orders in the selected date range per map bin, labelled with the bin's busiest place."""
+    codes, bin_lat, bin_lon = map_bins[km]
+    shown = (codes >= 0) & (city_orders > 0)
+    df = pd.DataFrame({'bin': codes[shown], 'place_name': city_keys['place_name'].to_numpy()[shown],
+                       'num_orders': city_orders[shown]})
+    totals = df.groupby('bin')['num_orders'].sum()
+    busiest = df.sort_values('num_orders').drop_duplicates('bin', keep='last').set_index('bin')['place_name']
+    return pd.DataFrame({
+        'place_name': busiest.reindex(totals.index).to_numpy(),
+        'latitude': bin_lat[totals.index],
+        'longitude': bin_lon[totals.index],
+        'num_orders': totals.to_numpy().astype(int)
+    })
+
+map_bins = load_location_bins((cube_version, output_version(DATA_DIR, "location_bins")))
+
+@st.cache_resource(max_entries=1)
+def load_margin_rollups(version):
+    """
+    Product margin at every grain, clustered by product, and the index of each product's
+    row range: selecting a product is a dict lookup and a zero-copy slice.
+    """
+    rollups, index = scan_output(DATA_DIR, "margin_rollups"), scan_output(DATA_DIR, "margin_rollups_index")
+    if rollups is None or index is None:
+        return None
+    index = index.collect()
+    product_index = dict(zip(index['fk_item'].to_list(), zip(index['offset'].to_list(), index['length'].to_list())))
+    return rollups.collect(), product_index, index['fk_item'].to_list()
+
+def product_margin_series(product, grain):
+    rollups, product_index = margin_rollups[:2]
+    offset, length = product_index[product]
+    return rollups.slice(offset, length).filter(pl.col('grain') == grain).select([
+        'period', (pl.col('margin_sum') / pl.col('margin_count')).alias('avg_margin')
+    ]).to_pandas()
+
+margin_rollups = load_margin_rollups((output_version(DATA_DIR, "margin_rollups"),
+                                      output_version(DATA_DIR, "margin_rollups_index")))
+
+def load_run_metrics():
+    # per-task metrics of the last ETL run, if it wrote them
+    path = os.path.join(DATA_DIR, METRICS_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+run_metrics = load_run_metrics()
 
 
 # For local testing purposes
@@ -82,19 +229,16 @@ st.markdown('<h1 class="main-header">GymBeam Analytics Dashboard</h1>', unsafe_a
 # -----------------------------
 st.sidebar.header("Filters & Controls")
 
-if 'created_at' in orders.columns:
-    date_range = st.sidebar.date_input(
-        "Select Date Range",
-        value=(orders['created_at'].min().date(), orders['created_at'].max().date()),
-        min_value=orders['created_at'].min().date(),
-        max_value=orders['created_at'].max().date()
-    )
-    orders_filtered = orders[
-        (orders['created_at'].dt.date >= date_range[0]) & 
-        (orders['created_at'].dt.date <= date_range[1])
-    ]
-else:
-    orders_filtered = orders
+first_day, last_day, city_keys, place_codes, place_names = city_cube[:5]
+date_range = st.sidebar.date_input(
+    "Select Date Range",
+    value=(first_day, last_day),
+    min_value=first_day,
+    max_value=last_day
+)
+city_totals = query_city_cube(date_range[0], date_range[-1])
+city_orders = city_totals['order_count']
+show_pipeline_health = run_metrics is not None and st.sidebar.checkbox("Show pipeline health", value=False)
 
 # -----------------------------
 # 6. Key metrics
@@ -102,11 +246,11 @@ else:
 col1, col2, col3, col4 = st.columns(4)
 
 with col1:
-    total_orders = len(orders_filtered)
+    total_orders = int(city_orders.sum())
     st.metric("Total Orders", f"{total_orders:,}")
 
 with col2:
-    total_revenue = orders_filtered['order_value'].sum()
+    total_revenue = city_totals['order_value_sum'].sum()
     if total_revenue >= 1000000:
         revenue_formatted = f"€{total_revenue/1000000:.1f}M"
     elif total_revenue >= 1000:
@@ -116,11 +260,11 @@ with col2:
     st.metric("Total Revenue", revenue_formatted)
 
 with col3:
-    avg_order_value = orders_filtered['order_value'].mean()
+    avg_order_value = total_revenue / city_totals['order_value_count'].sum() if city_totals['order_value_count'].sum() else float('nan')
     st.metric("Average Order Value", f"€{avg_order_value:.2f}")
 
 with col4:
-    unique_cities = orders_filtered['place_name'].nunique()
+    unique_cities = len(np.unique(place_codes[city_orders > 0]))
     st.metric("Cities Served", unique_cities)
 
 # -----------------------------
@@ -132,7 +276,12 @@ col1, col2 = st.columns([1, 1])
 
 with col1:
     st.subheader("Top 20 Cities by Average Order Value")
-    aov_by_city = orders_filtered.groupby("place_name").agg({"order_value": "mean"}).reset_index().rename(columns={"order_value": "AOV"})
+    place_orders = np.bincount(place_codes, weights=city_orders, minlength=len(place_names))
+    place_sum = np.bincount(place_codes, weights=city_totals['order_value_sum'], minlength=len(place_names))
+    place_valued = np.bincount(place_codes, weights=city_totals['order_value_count'], minlength=len(place_names))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        place_aov = np.where(place_valued > 0, place_sum / place_valued, np.nan)
+    aov_by_city = pd.DataFrame({"place_name": place_names, "AOV": place_aov})[place_orders > 0]
     top_20_cities = aov_by_city.sort_values("AOV", ascending=False).head(20)
     
     fig_bar = px.bar(
@@ -154,10 +303,22 @@ with col1:
 
 with col2:
     st.subheader("Geographic Distribution of Orders")
-    orders_count = orders_filtered.groupby(["place_name", "latitude", "longitude"]).size().reset_index(name="num_orders")
+    orders_count = city_keys.assign(num_orders=city_orders.astype(int))[city_orders > 0] \
+                            .dropna(subset=['latitude', 'longitude'])
+    if map_bins is not None:
+        # one point per grid cell instead of per location once there are too many to draw
+        point_counts = {km: len(np.unique(codes[(codes >= 0) & (city_orders > 0)])) for km, (codes, _, _) in map_bins.items()}
+        auto_km = next((km for km, n in point_counts.items() if n <= MAX_MAP_POINTS), max(point_counts)) \
+            if len(orders_count) > MAX_MAP_POINTS else None
+        options = ["Auto", "Locations"] + [f"{km:g} km" for km in map_bins]
+        resolution = st.select_slider("Map resolution:", options, value="Auto", key="map_resolution")
+        km = auto_km if resolution == "Auto" else None if resolution == "Locations" else float(resolution.split()[0])
+        if km is not None:
+            orders_count = binned_orders(km)
+        st.caption(f"{len(orders_count):,} points" + (f" on a {km:g} km grid" if km is not None else ""))
     
     fig_map = px.scatter_mapbox(
-        orders_count.dropna(subset=['latitude', 'longitude']),
+        orders_count,
         lat="latitude",
         lon="longitude",
         size="num_orders",
@@ -185,30 +346,36 @@ col1, col2 = st.columns([2, 1])
 
 with col1:
     st.subheader("Top 5 Candidate Cities for New Stores")
-    top_city = top5.sort_values("total_sales", ascending=False).iloc[0]
-    top5['highlight'] = top5['place_name'] == top_city['place_name']
+    top5 = load_output("top_5_city_recommendations")
+    if top5 is None:
+        missing_output("top_5_city_recommendations")
+    else:
+        top5 = top5.to_pandas()
+        top_city = top5.sort_values("total_sales", ascending=False).iloc[0]
+        top5['highlight'] = top5['place_name'] == top_city['place_name']
 
-    fig_recommend = px.scatter_mapbox(
-        top5,
-        lat="latitude",
-        lon="longitude",
-        size="total_sales",
-        color="highlight",
-        color_discrete_map={True: "red", False: "blue"},
-        hover_name="place_name",
-        hover_data={"latitude": False, "longitude": False, "total_sales": True, "min_distance_km": True},
-        zoom=5,
-        mapbox_style="carto-positron",
-        height=500
-    )
-    fig_recommend.update_layout(showlegend=False)
-    st.plotly_chart(fig_recommend, use_container_width=True)
+        fig_recommend = px.scatter_mapbox(
+            top5,
+            lat="latitude",
+            lon="longitude",
+            size="total_sales",
+            color="highlight",
+            color_discrete_map={True: "red", False: "blue"},
+            hover_name="place_name",
+            hover_data={"latitude": False, "longitude": False, "total_sales": True, "min_distance_km": True},
+            zoom=5,
+            mapbox_style="carto-positron",
+            height=500
+        )
+        fig_recommend.update_layout(showlegend=False)
+        st.plotly_chart(fig_recommend, use_container_width=True)
 
 with col2:
     st.subheader("Recommendation Details")
-    candidates_table = top5[['place_name', 'total_sales', 'min_distance_km']].sort_values('total_sales', ascending=False)
-    candidates_table.columns = ['City', 'Total Sales (€)', 'Distance (km)']
-    st.dataframe(candidates_table, use_container_width=True, hide_index=True)
+    if top5 is not None:
+        candidates_table = top5[['place_name', 'total_sales', 'min_distance_km']].sort_values('total_sales', ascending=False)
+        candidates_table.columns = ['City', 'Total Sales (€)', 'Distance (km)']
+        st.dataframe(candidates_table, use_container_width=True, hide_index=True)
 
 # -----------------------------
 # 9. Product analysis
@@ -218,40 +385,56 @@ st.markdown('<div class="section-header">Product Analysis</div>', unsafe_allow_h
 col1, col2 = st.columns([3, 2])
 
 with col1:
-    st.subheader("Monthly Product Margin Analysis")
-    product_names = sorted(monthly_margin_df['fk_item'].unique())
-    selected_product = st.selectbox('Select Product:', product_names, key="product_selector")
-    filtered_margin = monthly_margin_df[monthly_margin_df['fk_item'] == selected_product].copy()
-    
-    filtered_margin['year_month'] = pd.to_datetime(filtered_margin['year_month'])
-    filtered_margin = filtered_margin.sort_values('year_month')
-    
-    fig_margin = px.line(
-        filtered_margin, 
-        x='year_month', 
-        y='avg_margin', 
-        title=f'Monthly Margin Trend - Product {selected_product}',
-        labels={'year_month': 'Month', 'avg_margin': 'Average Margin'},
-        markers=True
-    )
+    st.subheader("Product Margin Analysis")
+    if margin_rollups is not None:
+        product_names = margin_rollups[2]
+        selected_product = st.selectbox('Select Product:', product_names, key="product_selector")
+        grain = st.radio('Granularity:', list(GRAIN_TICKS), index=2, horizontal=True, key="margin_grain")
+        filtered_margin = product_margin_series(selected_product, grain)
+    elif load_output("monthly_product_margin") is not None:
+        # outputs of an older ETL run, monthly only
+        grain = 'month'
+        monthly_margin_df = load_output("monthly_product_margin").to_pandas()
+        product_names = sorted(monthly_margin_df['fk_item'].unique())
+        selected_product = st.selectbox('Select Product:', product_names, key="product_selector")
+        filtered_margin = monthly_margin_df[monthly_margin_df['fk_item'] == selected_product] \
+                              .rename(columns={'year_month': 'period'}).sort_values('period')
+    else:
+        filtered_margin = None
+        missing_output("margin_rollups")
+
+    if filtered_margin is not None:
+        fig_margin = px.line(
+            filtered_margin, 
+            x='period', 
+            y='avg_margin', 
+            title=f'{grain.capitalize()} Margin Trend - Product {selected_product}',
+            labels={'period': grain.capitalize(), 'avg_margin': 'Average Margin'},
+            markers=True
+        )
     
-    fig_margin.update_traces(line=dict(width=3))
-    fig_margin.update_layout(
-        xaxis=dict(title='Month', tickformat="%Y-%m"),
-        yaxis=dict(title='Average Margin'),
-        height=450
-    )
-    st.plotly_chart(fig_margin, use_container_width=True)
+        fig_margin.update_traces(line=dict(width=3))
+        fig_margin.update_layout(
+            xaxis=dict(title=grain.capitalize(), tickformat=GRAIN_TICKS[grain]),
+            yaxis=dict(title='Average Margin'),
+            height=450
+        )
+        st.plotly_chart(fig_margin, use_container_width=True)
 
 with col2:
     st.subheader("Top Product Combinations")
-    top_pairs_df['Product Pair'] = top_pairs_df['product_1'].astype(str) + " + " + top_pairs_df['product_2'].astype(str)
-    top_pairs_df['Percent'] = top_pairs_df['percent_of_orders'].round(2)
+    top_pairs_df = load_output("top_10_product_pairs")
+    if top_pairs_df is None:
+        missing_output("top_10_product_pairs")
+    else:
+        top_pairs_df = top_pairs_df.to_pandas()
+        top_pairs_df['Product Pair'] = top_pairs_df['product_1'].astype(str) + " + " + top_pairs_df['product_2'].astype(str)
+        top_pairs_df['Percent'] = top_pairs_df['percent_of_orders'].round(2)
     
-    pairs_display = top_pairs_df[['Product Pair', 'count', 'Percent']].head(10).copy()
-    pairs_display.columns = ['Product Combination', 'Orders', 'Percentage (%)']
-    pairs_display.index = range(1, len(pairs_display) + 1)
-    st.dataframe(pairs_display, use_container_width=True, height=450)
+        pairs_display = top_pairs_df[['Product Pair', 'count', 'Percent']].head(10).copy()
+        pairs_display.columns = ['Product Combination', 'Orders', 'Percentage (%)']
+        pairs_display.index = range(1, len(pairs_display) + 1)
+        st.dataframe(pairs_display, use_container_width=True, height=450)
 
 # -----------------------------
 # 10. Detailed data tables
@@ -267,18 +450,71 @@ with st.expander("View Detailed Data Tables"):
     
     with tab2:
         st.subheader("All Product Combinations")
-        pairs_display = top_pairs_df[['Product Pair', 'count', 'Percent']].copy()
-        pairs_display.columns = ['Product Combination', 'Orders', 'Percentage (%)']
-        st.dataframe(pairs_display, use_container_width=True)
+        if top_pairs_df is None:
+            missing_output("top_10_product_pairs")
+        else:
+            pairs_display = top_pairs_df[['Product Pair', 'count', 'Percent']].copy()
+            pairs_display.columns = ['Product Combination', 'Orders', 'Percentage (%)']
+            st.dataframe(pairs_display, use_container_width=True)
     
     with tab3:
         st.subheader("Product Margin History")
-        margin_display = monthly_margin_df.copy()
-        margin_display['avg_margin'] = margin_display['avg_margin'].round(2)
-        st.dataframe(margin_display, use_container_width=True)
+        margin_display = load_output("monthly_product_margin")
+        if margin_display is None:
+            missing_output("monthly_product_margin")
+        else:
+            st.dataframe(margin_display.with_columns(pl.col('avg_margin').round(2)), use_container_width=True)
+
+# -----------------------------
+# 11. Pipeline health
+# -----------------------------
+if show_pipeline_health:
+    st.markdown('<div class="section-header">Pipeline Health</div>', unsafe_allow_html=True)
+    tasks = pd.DataFrame(run_metrics['tasks'])
+    ran = tasks[tasks['status'] != 'cached'] if 'status' in tasks else tasks
+
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Last Run", run_metrics['status'].capitalize())
+    col2.metric("Run Time", f"{run_metrics['wall_s']:.1f} s")
+    col3.metric("Peak Memory", f"{ran['peak_rss_mb'].max():.0f} MB" if len(ran) else "-")
+    col4.metric("Tasks Run / Cached", f"{len(ran)} / {len(tasks) - len(ran)}")
+    st.caption("Finished " + pd.Timestamp(run_metrics['finished_at'], unit='s').strftime("%Y-%m-%d %H:%M")
+               + ". Memory and CPU are process wide, so tasks running at the same time share them.")
+
+    if len(ran):
+        col1, col2 = st.columns([1, 1])
+        with col1:
+            fig_tasks = px.bar(
+                ran.sort_values('wall_s'),
+                x='wall_s',
+                y='task',
+                color='status',
+                orientation='h',
+                title="Wall Time per Task",
+                labels={'wall_s': 'Wall Time (s)', 'task': 'Task'},
+                color_discrete_map={'ok': '#3498db', 'failed': '#e74c3c'}
+            )
+            fig_tasks.update_layout(height=400)
+            st.plotly_chart(fig_tasks, use_container_width=True)
+        with col2:
+            health_display = ran[['task', 'status', 'wall_s', 'cpu_s', 'peak_rss_mb', 'rows_in', 'rows_out']].copy()
+            health_display['MB Written'] = (ran['bytes_written'] / 2**20).round(2)
+            health_display.columns = ['Task', 'Status', 'Wall (s)', 'CPU (s)', 'Peak RSS (MB)', 'Rows In', 'Rows Out', 'MB Written']
+            st.dataframe(health_display, use_container_width=True, height=400, hide_index=True)
+
+        for error in ran.get('error', pd.Series(dtype=object)).dropna():
+            st.error(error)
+
+    plans = [t for t in run_metrics['tasks'] if 'plans' in t]
+    if plans:
+        with st.expander("Query Plans"):
+            for t in plans:
+                for name, plan in t['plans'].items():
+                    st.markdown(f"**{t['task']} / {name}**")
+                    st.code(plan)
 
 # -----------------------------
-# 11. Footer
+# 12. Footer
 # -----------------------------
 st.markdown("---")
 st.markdown("Dashboard created with care for GymBeam Analytics | Data updated: " + 
@@ -0,0 +1,55 @@
+# compact.py
+import numpy as np
+import polars as pl
+
+# 32 character hex order keys, packed into one UInt128
+ORDER_KEYS = ['pk_sales_order', 'fk_sales_order']
+# a key survives the round trip through UInt128 unchanged only as 32 lower-case hex characters
+KEY_LENGTH = 32
+NOT_HEX = r"[^0-9a-f]"
+# low-cardinality columns (postal codes are read as integers, they are cast through strings)
+CATEGORICAL = ['currency', 'country_code', 'postal_code', 'fk_item']
+
+HEX = np.array([f"{i:02x}" for i in range(256)], dtype='S2')
+
+def compact_types(df, encode_keys: bool = True):
+    """
+    Load-time schema layer, works on DataFrames and LazyFrames: order keys become UInt128
+    (so joins and group-bys compare one integer instead of a 32 byte string) and the
+    low-cardinality columns Categorical. Keys must be 32 character lower-case hex strings,
+    anything else raises a ValueError when the frame is collected; use encode_keys=False
+    for other key formats. output_writer.conform decodes them on export.
+    """
+    schema = df.collect_schema()
+    exprs = [pl.col(c).cast(pl.Utf8).cast(pl.Categorical) for c in CATEGORICAL
+             if c in schema and schema[c] != pl.Categorical]
+    if encode_keys:
+        exprs += [encoded(c) for c in ORDER_KEYS if c in schema and schema[c] == pl.Utf8]
+    return df.with_columns(exprs) if exprs else df
+
+def check_keys(s: pl.Series) -> pl.Series:
+    """s unchanged if all its keys are 32 lower-case hex characters; '00ab' or upper-case keys would not decode back to themselves."""
+    bad = s.filter((s.str.len_bytes() != KEY_LENGTH) | s.str.contains(NOT_HEX))
+    if len(bad):
+        raise ValueError(f"compact_keys: {s.name} {bad[0]!r} is not a 32 character lower-case hex key, "
+                         "run with compact_keys=False for this key format")
+    return s
+
+def encoded(col: str) -> pl.Expr:
+    return pl.col(col).map_batches(check_keys, return_dtype=pl.Utf8, is_elementwise=True) \
+                      .str.to_integer(base=16, dtype=pl.UInt128)
+
+def decode_keys(s: pl.Series) -> pl.Series:
+    """UInt128 keys back to their 32 character lower-case hex form."""
+    words = s.to_frame('key').select(
+        (pl.col('key') // pl.lit(2**64, dtype=pl.UInt128)).cast(pl.UInt64).alias('hi'),
+        (pl.col('key') % pl.lit(2**64, dtype=pl.UInt128)).cast(pl.UInt64).alias('lo')
+    )
+    packed = np.empty((len(s), 2), dtype='>u8')
+    packed[:, 0] = words['hi'].fill_null(0).to_numpy()
+    packed[:, 1] = words['lo'].fill_null(0).to_numpy()
+    hex_keys = pl.Series(s.name, HEX[packed.view(np.uint8)].view('S32').ravel(), dtype=pl.Binary).cast(pl.Utf8)
+    return hex_keys.set(s.is_null(), None) if s.null_count() else hex_keys
+
+def decoded(col: str) -> pl.Expr:
+    return pl.col(col).map_batches(decode_keys, return_dtype=pl.Utf8)
@@ -1,55 +1,41 @@
 # etl_analysis.py
 import polars as pl
-import urllib.request
-import zipfile
-import io
+import functools
+import hashlib
+import inspect
+import math
+import multiprocessing
 import os
-from itertools import combinations
-import numpy as np
+import shutil
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
 from prefect import task, flow
-from collections import Counter
-
-# -----------------------------
-# 1. Download postal codes
-# -----------------------------
-def download_postal_codes_github(url: str, country_code: str) -> pl.DataFrame:
-    response = urllib.request.urlopen(url)
-    zip_data = response.read()
-    with zipfile.ZipFile(io.BytesIO(zip_data)) as z:
-        csv_files = [f for f in z.namelist() if f.endswith(".csv")]
-        if not csv_files:
-            raise ValueError(f"No CSV found in ZIP for {country_code}")
-        with z.open(csv_files[0]) as f:
-            df = pl.read_csv(f)
-
-    df = df.select(['zipcode', 'place', 'latitude', 'longitude'])
-    df = df.with_columns([
-        pl.col('zipcode').cast(pl.Utf8).str.replace_all(" ", "").str.zfill(5).alias('postal_code'),
-        pl.col('place').fill_null('Unknown').alias('place_name'),
-        pl.col('latitude').cast(pl.Float64),
-        pl.col('longitude').cast(pl.Float64),
-        pl.lit(country_code).alias('country_code')
-    ])
-
-    df_unique = df.group_by('postal_code').agg([
-        pl.first('place_name'),
-        pl.first('latitude'),
-        pl.first('longitude'),
-        pl.first('country_code')
-    ])
-    return df_unique
+from prefect.task_runners import ThreadPoolTaskRunner
+from prefect.utilities.hashing import hash_objects
+from postal_codes import POSTAL_URLS, CITY_ALIASES, load_postal_codes, normalize_place_names
+from product_affinity import co_occurrence, frequent_itemsets_streaming, pair_counts, merge_pair_counts
+from spatial import DEFAULT_STORES, stores_frame, greedy_store_locations, location_bins
+from output_writer import OutputWriter, conform, month_key, read_manifest
+from compact import compact_types
+from incremental import (CREATED_AT_FORMAT, STATE_KEYS, DAILY_KEYS, read_watermark, write_watermark, upsert, update_location_sales,
+                         update_margin_ledger, merge_margin_state)
+from instrumentation import METRICS_FILE, measure, instrumented, attach, capture_plans, record_cache_hit, start_run, finish_run
+from run_history import HISTORY_FILE, record_run, growth_warnings
+
+# the tasks that read the CSVs themselves scale with their size
+FILE_INPUTS = ("orders_path", "items_path")
 
 # -----------------------------
-# 2. Prefect ETL tasks
+# 1. Prefect ETL tasks
 # -----------------------------
-@task
-def load_clean_orders_items(orders_path: str, items_path: str, output_dir: str):
-    orders = pl.read_csv(orders_path)
-    items = pl.read_csv(items_path)
+def normalize_columns(df):
+    return df.rename({c: c.strip().lower().replace(" ", "_") for c in df.collect_schema().names()})
 
-    # normalize column names
-    orders = orders.rename({c: c.strip().lower().replace(" ", "_") for c in orders.columns})
-    items = items.rename({c: c.strip().lower().replace(" ", "_") for c in items.columns})
+def clean_orders_items(orders, items, compact_keys: bool = True):
+    """Works on both eager DataFrames and LazyFrames."""
+    orders = parse_created_at(compact_types(normalize_columns(orders), compact_keys))
+    items = compact_types(normalize_columns(items), compact_keys)
 
     # cast numeric columns
     items = items.with_columns([
@@ -57,179 +43,869 @@ def load_clean_orders_items(orders_path: str, items_path: str, output_dir: str):
         pl.col('sold_qty').cast(pl.Float64),
         pl.col('product_cost_eur').cast(pl.Float64)
     ])
-
-    os.makedirs(output_dir, exist_ok=True)
-    orders.write_csv(f"{output_dir}/orders_cleaned.csv")
-    items.write_csv(f"{output_dir}/items_cleaned.csv")
     return orders, items
 
-@task
-def calculate_order_values(orders: pl.DataFrame, items: pl.DataFrame):
-    items = items.with_columns((pl.col('product_price_local_currency') * pl.col('sold_qty')).alias('line_total'))
-    order_totals = items.group_by('fk_sales_order').agg([pl.sum('line_total').alias('order_value')])
-    enriched_orders = orders.join(order_totals, left_on='pk_sales_order', right_on='fk_sales_order', how='left')
-    return enriched_orders
+def order_lines(items, orders):
+    """
+    Order-line fact table the order values, product pairs and margin are all derived from:
+    items joined once with their order's created_at, line_total, margin and year_month computed once.
+    """
+    lines = items.join(parse_created_at(orders.select(['pk_sales_order', 'created_at'])),
+                       left_on='fk_sales_order', right_on='pk_sales_order', how='inner')
+    price, qty = pl.col('product_price_local_currency'), pl.col('sold_qty')
+    return lines.with_columns([
+        (price * qty).alias('line_total'),
+        ((price - pl.col('product_cost_eur')) * qty).alias('margin'),
+        pl.col('created_at').dt.truncate("1mo").alias('year_month')
+    ])
 
-@task
-def enrich_orders_with_cities(orders: pl.DataFrame, postal_df: pl.DataFrame, output_dir: str):
+def with_order_values(orders, lines):
+    order_totals = lines.group_by('fk_sales_order').agg([pl.sum('line_total').alias('order_value')])
+    return orders.join(order_totals, left_on='pk_sales_order', right_on='fk_sales_order', how='left')
+
+def with_cities(orders, postal_df, city_aliases: dict = CITY_ALIASES):
     orders = orders.with_columns(
         pl.col('postal_code').cast(pl.Utf8).str.replace_all(r"\.0$", "").str.zfill(5)
     )
 
+    postal_df = postal_df.with_columns(pl.col('country_code').cast(orders.collect_schema()['country_code']))
     enriched = orders.join(postal_df, on=['postal_code', 'country_code'], how='left')
     enriched = enriched.with_columns(pl.col('place_name').fill_null('Unknown'))
 
-    # normalize city names
-    major_cities = ["Bratislava", "Košice", "Praha", "Brno", "Budapest"]
-    for city in major_cities:
-        enriched = enriched.with_columns(
-            pl.when(pl.col("place_name").str.to_lowercase().str.starts_with(city.lower()))
-            .then(pl.lit(city))
-            .otherwise(pl.col("place_name"))
-            .alias("place_name")
-        )
-
-    os.makedirs(output_dir, exist_ok=True)
-    enriched.write_csv(f"{output_dir}/orders_enriched.csv")
+    # normalize district and suburb names to their city
+    return normalize_place_names(enriched, city_aliases)
+
+def parse_created_at(df):
+    if df.collect_schema()['created_at'] == pl.Utf8:
+        return df.with_columns(pl.col('created_at').str.strptime(pl.Datetime, format=CREATED_AT_FORMAT))
+    return df
+
+def daily_city_sales(orders):
+    """Daily x delivery location cube the dashboard answers its date-range queries from."""
+    return parse_created_at(orders).group_by([
+        pl.col('created_at').dt.date().alias('date'), 'place_name', 'latitude', 'longitude'
+    ]).agg([
+        pl.len().alias('order_count'),
+        pl.sum('order_value').alias('order_value_sum'),
+        pl.col('order_value').count().alias('order_value_count')
+    ]).sort(['date', 'place_name', 'latitude', 'longitude'])
+
+@task
+@instrumented(volume=FILE_INPUTS)
+def load_clean_orders_items(orders_path: str, items_path: str, writer: OutputWriter, compact_keys: bool = True):
+    orders, items = clean_orders_items(pl.read_csv(orders_path), pl.read_csv(items_path), compact_keys)
+
+    writer.write("orders_cleaned", orders)
+    writer.write("items_cleaned", items)
+    return orders, items
+
+@task
+@instrumented(volume=("items",))
+def build_order_lines(orders: pl.DataFrame, items: pl.DataFrame):
+    return order_lines(items, orders)
+
+@task
+@instrumented(volume=("lines",))
+def calculate_order_values(orders: pl.DataFrame, lines: pl.DataFrame):
+    return with_order_values(orders, lines)
+
+@task
+@instrumented(volume=("orders",))
+def enrich_orders_with_cities(orders: pl.DataFrame, postal_df: pl.DataFrame, writer: OutputWriter,
+                              city_aliases: dict = CITY_ALIASES):
+    enriched = with_cities(orders, postal_df, city_aliases)
+    writer.write("orders_enriched", enriched)
     return enriched
 
+@task
+@instrumented(volume=("orders",))
+def daily_city_cube(orders: pl.DataFrame, writer: OutputWriter):
+    cube = daily_city_sales(orders)
+    writer.write("daily_city_sales", cube)
+    writer.write("location_bins", location_bins(cube))
+    return cube
+
 # -----------------------------
-# 3. Top 5 store candidates
+# 2. Top 5 store candidates
 # -----------------------------
-@task
-def top_5_store_candidates(orders: pl.DataFrame, output_dir: str):
+def store_candidates(orders, stores: dict = DEFAULT_STORES, radius_km: float = 50):
     city_sales = orders.group_by(['place_name', 'latitude', 'longitude']).agg([
         pl.sum('order_value').alias('total_sales')
     ])
-
-    existing_stores = orders.filter(pl.col('place_name').is_in(['Košice','Budapest','Praha'])) \
-                            .group_by('place_name').agg([
-                                pl.first('latitude').alias('latitude'),
-                                pl.first('longitude').alias('longitude')
-                            ]).rename({'place_name':'store'})
+    existing_stores = stores_frame(stores)
+    if isinstance(orders, pl.LazyFrame):
+        existing_stores = existing_stores.lazy()
 
     # Haversine distance calculation
-    city_lat = city_sales['latitude'].to_numpy()
-    city_lon = city_sales['longitude'].to_numpy()
-    store_lat = existing_stores['latitude'].to_numpy()
-    store_lon = existing_stores['longitude'].to_numpy()
-
     R = 6371
-    min_distances = []
-    for i in range(len(city_lat)):
-        lat1, lon1 = np.radians(city_lat[i]), np.radians(city_lon[i])
-        lat2, lon2 = np.radians(store_lat), np.radians(store_lon)
-        dphi = lat2 - lat1
-        dlambda = lon2 - lon1
-        a = np.sin(dphi/2)**2 + np.cos(lat1)*np.cos(lat2)*np.sin(dlambda/2)**2
-        distances = 2*R*np.arcsin(np.sqrt(a))
-        min_distances.append(distances.min())
-
-    city_sales = city_sales.with_columns(pl.Series(name='min_distance_km', values=min_distances))
-    top5 = city_sales.filter(pl.col('min_distance_km') > 50)
-    top5 = top5.sort(['total_sales', 'min_distance_km'], descending=[True, True]).head(5)
-    top5.write_csv(f"{output_dir}/top_5_city_recommendations.csv")
+    lat1, lon1 = pl.col('latitude').radians(), pl.col('longitude').radians()
+    lat2, lon2 = pl.col('store_latitude').radians(), pl.col('store_longitude').radians()
+    a = ((lat2 - lat1) / 2).sin()**2 + lat1.cos() * lat2.cos() * ((lon2 - lon1) / 2).sin()**2
+    distances = city_sales.with_row_index('city_idx').join(existing_stores, how='cross') \
+                          .with_columns((2 * R * a.sqrt().arcsin()).alias('distance_km'))
+    city_sales = distances.group_by('city_idx').agg([
+        pl.first('place_name'),
+        pl.first('latitude'),
+        pl.first('longitude'),
+        pl.first('total_sales'),
+        pl.min('distance_km').alias('min_distance_km')
+    ]).drop('city_idx')
+
+    top5 = city_sales.filter(pl.col('min_distance_km') > radius_km)
+    return top5.sort(['total_sales', 'min_distance_km'], descending=[True, True]).head(5)
+
+def location_sales(orders):
+    """Order value per month and delivery location, mergeable month by month; store_candidates accepts it as orders."""
+    return orders.group_by([month_key('created_at').alias('year_month'), 'place_name', 'latitude', 'longitude']) \
+                 .agg(pl.sum('order_value'))
+
+@task
+@instrumented(volume=("orders",))
+def top_5_store_candidates(orders: pl.DataFrame, writer: OutputWriter, stores: dict = DEFAULT_STORES, radius_km: float = 50):
+    top5 = store_candidates(orders, stores, radius_km)
+    writer.write("top_5_city_recommendations", top5)
     return top5
 
+@task
+@instrumented(volume=("orders",))
+def new_store_locations(orders: pl.DataFrame, postal_df: pl.DataFrame, writer: OutputWriter, n_new: int = 5,
+                        stores: dict = DEFAULT_STORES, radius_km: float = 50):
+    """
+    Greedy facility location: picks n_new postal code centroids that cover the most
+    sales not yet within radius_km of a store.
+    """
+    city_sales = orders.group_by(['place_name', 'latitude', 'longitude']).agg([
+        pl.sum('order_value').alias('total_sales')
+    ])
+    locations = greedy_store_locations(city_sales, postal_df, n_new, stores, radius_km)
+    writer.write("greedy_store_locations", locations)
+    return locations
+
 # -----------------------------
-# 4. Top 10 product pairs
+# 3. Top 10 product pairs
 # -----------------------------
-
-@task
-def top_10_product_pairs(items: pl.DataFrame, orders: pl.DataFrame, output_dir: str):
-    items_filtered = items.filter(
+def basket_lines(lines):
+    return lines.filter(
         ~((pl.col('product_price_local_currency') == 0) & (pl.col('product_cost_eur') > 0))
     )
 
-    df = items_filtered.join(
-        orders.select(['pk_sales_order']),
-        left_on='fk_sales_order',
-        right_on='pk_sales_order',
-        how='inner'
-    )
+# chunks the pair sketch splits the orders into, unless given
+PAIR_CHUNKS = 16
 
-    df = df.with_columns(
-        ((pl.col('product_price_local_currency') - pl.col('product_cost_eur')) * pl.col('sold_qty')).alias('margin')
-    )
+def product_pairs(lines, top_n: int = 10, min_support: float = 0.0, max_basket_size: int | None = None):
+    return co_occurrence(basket_lines(lines), top_n, min_support, max_basket_size)
 
-    top_pairs = Counter()
-    grouped = df.group_by('fk_sales_order').agg(pl.col('fk_item').alias('products'))
-
-    for row in grouped.to_dicts():
-        products = [str(p) for p in row['products'] if p is not None]
-        if len(products) > 1:
-            pairs = combinations(sorted(products), 2)
-            top_pairs.update(pairs)
-
-    total_orders = df['fk_sales_order'].n_unique()
-    top_10_pairs = top_pairs.most_common(10)
-    top_10_pairs_percent = [(pair, count, count/total_orders*100) for pair, count in top_10_pairs]
-
-    if top_10_pairs_percent:
-        top_pairs_df = pl.DataFrame({
-            'product_1': [pair[0] for pair, count, percent in top_10_pairs_percent],
-            'product_2': [pair[1] for pair, count, percent in top_10_pairs_percent],
-            'count': [count for pair, count, percent in top_10_pairs_percent],
-            'percent_of_orders': [percent for pair, count, percent in top_10_pairs_percent]
-        })
+def write_product_pairs(lines, writer: OutputWriter, min_support: float = 0.0, max_basket_size: int | None = None,
+                        approximate: bool = False, sketch_capacity: int = 10_000, n_chunks: int = PAIR_CHUNKS,
+                        triples: bool = False):
+    """
+    With approximate=True the pairs (and, with triples=True, also triples) are found by the
+    bounded-memory sketch in product_affinity and verified by an exact re-count.
+    """
+    if not approximate:
+        top_pairs_df = product_pairs(lines, 10, min_support, max_basket_size)
     else:
-        top_pairs_df = pl.DataFrame({
-            'product_1': [],
-            'product_2': [],
-            'count': [],
-            'percent_of_orders': []
-        })
-
-    os.makedirs(output_dir, exist_ok=True)
-    top_pairs_df.write_csv(f"{output_dir}/top_10_product_pairs.csv")
+        lines = basket_lines(lines)
+        top_pairs_df = frequent_itemsets_streaming(lines, 10, 2, sketch_capacity, n_chunks, min_support, max_basket_size)
+        if triples:
+            top_triples_df = frequent_itemsets_streaming(lines, 10, 3, sketch_capacity, n_chunks, min_support, max_basket_size)
+            writer.write("top_10_product_triples", top_triples_df)
+
+    writer.write("top_10_product_pairs", top_pairs_df)
     return top_pairs_df
 
+@task
+@instrumented(volume=("lines",))
+def top_10_product_pairs(lines: pl.DataFrame, writer: OutputWriter,
+                         min_support: float = 0.0, max_basket_size: int | None = None,
+                         approximate: bool = False, sketch_capacity: int = 10_000, n_chunks: int = PAIR_CHUNKS,
+                         triples: bool = False):
+    return write_product_pairs(lines, writer, min_support, max_basket_size, approximate, sketch_capacity, n_chunks, triples)
+
 # -----------------------------
-# 5. Monthly product margin
+# 4. Product margin
 # -----------------------------
-@task
-def monthly_product_margin(items: pl.DataFrame, orders: pl.DataFrame, output_dir: str):
-    df = items.join(orders.select(['pk_sales_order','created_at']), left_on='fk_sales_order', right_on='pk_sales_order', how='inner')
-    df = df.filter(pl.col('fk_item').is_not_null())
-    df = df.with_columns(((pl.col('product_price_local_currency') - pl.col('product_cost_eur')) * pl.col('sold_qty')).alias('margin'))
-    df = df.with_columns(pl.col('created_at').str.strptime(pl.Datetime, format="%Y-%m-%d %H:%M:%S%.f"))
-    df = df.with_columns((pl.col('created_at').dt.truncate("1mo")).alias('year_month'))
-
-    monthly_margin = df.group_by(['fk_item','year_month']).agg([
+# rollup grain -> truncation of the day
+ROLLUP_GRAINS = {'day': '1d', 'week': '1w', 'month': '1mo', 'quarter': '1q'}
+
+def margin_lines(lines):
+    return lines.filter(pl.col('fk_item').is_not_null())
+
+def product_margin(lines):
+    return margin_lines(lines).group_by(['fk_item','year_month']).agg([
         pl.mean('margin').alias('avg_margin')
     ]).sort(['fk_item','year_month'])
-    monthly_margin.write_csv(f"{output_dir}/monthly_product_margin.csv")
+
+def margin_contributions(lines):
+    """Mergeable per-order margin state: sum and count instead of the mean."""
+    return margin_lines(lines).group_by([
+        'fk_sales_order', 'fk_item', 'year_month', pl.col('created_at').dt.date().alias('date')
+    ]).agg([
+        pl.sum('margin').alias('margin_sum'),
+        pl.col('margin').count().alias('margin_count')
+    ])
+
+def daily_margin(lines):
+    """Mergeable margin state per (fk_item, date), every rollup is derived from it."""
+    return margin_lines(lines).group_by(['fk_item', pl.col('created_at').dt.date().alias('date')]).agg([
+        pl.sum('margin').alias('margin_sum'),
+        pl.col('margin').count().alias('margin_count')
+    ])
+
+def margin_rollups(daily):
+    """
+    Margin sum and count per product at every grain of ROLLUP_GRAINS, clustered by product
+    (rows sorted by fk_item, grain, period) so one product's series is a contiguous range.
+    """
+    rollups = [
+        daily.group_by(['fk_item', pl.col('date').dt.truncate(every).alias('period')]).agg([
+            pl.sum('margin_sum'), pl.sum('margin_count')
+        ]).select(['fk_item', pl.lit(grain).alias('grain'), 'period', 'margin_sum', 'margin_count'])
+        for grain, every in ROLLUP_GRAINS.items()
+    ]
+    return pl.concat(rollups).sort(['fk_item', 'grain', 'period'])
+
+def rollup_index(rollups: pl.DataFrame) -> pl.DataFrame:
+    """fk_item -> offset and length of its rows in the clustered rollups."""
+    return rollups.group_by('fk_item', maintain_order=True).agg(pl.len().alias('length')) \
+                  .with_columns((pl.col('length').cum_sum() - pl.col('length')).alias('offset')) \
+                  .select(['fk_item', 'offset', 'length'])
+
+def write_margin_rollups(writer: OutputWriter, rollups: pl.DataFrame):
+    writer.write("margin_rollups", rollups)
+    writer.write("margin_rollups_index", rollup_index(rollups))
+
+@task
+@instrumented(volume=("lines",))
+def monthly_product_margin(lines: pl.DataFrame, writer: OutputWriter):
+    monthly_margin = product_margin(lines)
+    writer.write("monthly_product_margin", monthly_margin)
     return monthly_margin
 
+@task
+@instrumented(volume=("lines",))
+def product_margin_rollups(lines: pl.DataFrame, writer: OutputWriter):
+    rollups = margin_rollups(daily_margin(lines))
+    write_margin_rollups(writer, rollups)
+    return rollups
+
+# -----------------------------
+# 5. Lazy end-to-end plan
+# -----------------------------
+@task
+@instrumented(volume=FILE_INPUTS)
+def run_lazy_pipeline(orders_path: str, items_path: str, postal_df: pl.DataFrame, writer: OutputWriter,
+                      pairs_min_support: float = 0.0, pairs_max_basket_size: int | None = None,
+                      pairs_approximate: bool = False, stores: dict = DEFAULT_STORES, radius_km: float = 50,
+                      city_aliases: dict = CITY_ALIASES, compact_keys: bool = True):
+    """
+    Builds the whole pipeline as one LazyFrame graph over scan_csv and collects it once,
+    so Polars can push projections/predicates down and reuse the shared subplans.
+    """
+    orders, items = clean_orders_items(pl.scan_csv(orders_path), pl.scan_csv(items_path), compact_keys)
+    lines = order_lines(items, orders)
+    enriched = with_cities(with_order_values(orders, lines), postal_df.lazy(), city_aliases)
+
+    cube = daily_city_sales(enriched)
+    plans = {
+        "orders_cleaned": orders,
+        "orders_enriched": enriched,
+        "daily_city_sales": cube,
+        "location_bins": location_bins(cube),
+        "top_5_city_recommendations": store_candidates(enriched, stores, radius_km),
+        "monthly_product_margin": product_margin(lines),
+        "margin_rollups": margin_rollups(daily_margin(lines)),
+    }
+    if not pairs_approximate:
+        plans["top_10_product_pairs"] = product_pairs(lines, 10, pairs_min_support, pairs_max_basket_size)
+    if capture_plans():
+        attach('plans', {name: plan.explain() for name, plan in plans.items()})
+    sinks = writer.sink("items_cleaned", items)
+    results = dict(zip(plans, pl.collect_all(list(plans.values()) + sinks)))
+
+    writer.register("items_cleaned")
+    for name, df in results.items():
+        if name == "margin_rollups":
+            write_margin_rollups(writer, df)
+        else:
+            writer.write(name, df)
+    return results
+
+# -----------------------------
+# 6. Incremental mode
+# -----------------------------
+@task
+@instrumented(volume=FILE_INPUTS)
+def run_incremental_update(orders_path: str, items_path: str, postal_df: pl.DataFrame, writer: OutputWriter,
+                           lookback_days: int = 0, stores: dict = DEFAULT_STORES, radius_km: float = 50,
+                           city_aliases: dict = CITY_ALIASES, compact_keys: bool = True,
+                           pairs_min_support: float = 0.0, pairs_max_basket_size: int | None = None,
+                           pairs_approximate: bool = False, pairs_sketch_capacity: int = 10_000,
+                           pairs_chunks: int = PAIR_CHUNKS, product_triples: bool = False):
+    """
+    Processes only orders created after the stored watermark (minus lookback_days, to pick up
+    late changes). Only the months those orders fall into are read and rewritten: their
+    orders_cleaned, orders_enriched and daily_city_sales partitions are replaced, the monthly
+    margin and the order value per delivery location (for store candidates and map bins) are
+    merged into state kept in output_dir/state. An order keeps its created_at, so its earlier
+    version is in the same months. The first run without state processes everything and also
+    writes items_cleaned and the product pairs; those are not mergeable month by month and
+    later runs leave them as of the last full rebuild.
+    """
+    state_dir = f"{writer.output_dir}/state"
+    watermark = read_watermark(state_dir)
+    if watermark is not None and not all(os.path.exists(os.path.join(state_dir, f))
+                                         for f in ["margin_daily_state.parquet", "location_sales.parquet"]):
+        # state written by an older version, rebuild it
+        watermark = None
+    if watermark is None:
+        # full rebuild, drop any half-written state
+        shutil.rmtree(state_dir, ignore_errors=True)
+
+    orders, items = clean_orders_items(pl.scan_csv(orders_path), pl.scan_csv(items_path), compact_keys)
+    if watermark is not None:
+        cutoff = pl.lit(watermark).str.strptime(pl.Datetime, format=CREATED_AT_FORMAT) - pl.duration(days=lookback_days)
+        orders = orders.filter(pl.col('created_at') > cutoff)
+    new_orders = orders.collect()
+    if new_orders.is_empty():
+        print(f"No orders after watermark {watermark}.")
+        return None
+    new_lines = order_lines(items, new_orders.lazy()).collect()
+    months = sorted(new_orders.select(month_key('created_at').unique())['created_at'].to_list())
+
+    # order level: upsert by order key into the touched months
+    cleaned_old = writer.read("orders_cleaned", months) if watermark is not None else None
+    cleaned = upsert(cleaned_old, conform("orders_cleaned", new_orders), ['pk_sales_order'])
+    enriched_new = conform("orders_enriched", with_cities(with_order_values(new_orders, new_lines), postal_df, city_aliases))
+    enriched_old = writer.read("orders_enriched", months) if watermark is not None else None
+    enriched = upsert(enriched_old, enriched_new, ['pk_sales_order'])
+
+    # monthly level: back out the previous contributions of reprocessed orders, add the new ones
+    # the state keeps the exported key types, independent of compact_keys
+    contributions = conform("margin_ledger", margin_contributions(new_lines))
+    new_keys = conform("orders_cleaned", new_orders.select('pk_sales_order'))
+    ledger_months = set(contributions['year_month'].unique().to_list())
+    if enriched_old is not None:
+        reprocessed = enriched_old.join(new_keys, on='pk_sales_order', how='semi')
+        ledger_months |= set(reprocessed['created_at'].dt.truncate("1mo").unique().to_list())
+    replaced = update_margin_ledger(state_dir, contributions, new_keys['pk_sales_order'], sorted(ledger_months))
+    state = merge_margin_state(state_dir, contributions, replaced)
+    monthly_margin = state.select(STATE_KEYS + [(pl.col('margin_sum') / pl.col('margin_count')).alias('avg_margin')])
+    rollups = margin_rollups(merge_margin_state(state_dir, contributions, replaced, DAILY_KEYS, "margin_daily_state"))
+    sales = update_location_sales(state_dir, location_sales(enriched), months if watermark is not None else None)
+
+    # the touched months hold all their orders, so their cube partitions are complete
+    cube = daily_city_sales(enriched)
+    top_pairs = None
+    if watermark is None:
+        writer.write("orders_cleaned", cleaned)
+        writer.write("orders_enriched", enriched)
+        writer.write("daily_city_sales", cube)
+        pl.collect_all(writer.sink("items_cleaned", items))
+        writer.register("items_cleaned")
+        top_pairs = write_product_pairs(new_lines, writer, pairs_min_support, pairs_max_basket_size, pairs_approximate,
+                                        pairs_sketch_capacity, pairs_chunks, product_triples)
+    else:
+        writer.write_partitions("orders_cleaned", cleaned, months)
+        writer.write_partitions("orders_enriched", enriched, months)
+        writer.write_partitions("daily_city_sales", cube, months)
+    writer.write("location_bins", location_bins(sales))
+    writer.write("monthly_product_margin", monthly_margin)
+    write_margin_rollups(writer, rollups)
+    top5 = store_candidates(sales, stores, radius_km)
+    writer.write("top_5_city_recommendations", top5)
+
+    latest = new_orders['created_at'].max()
+    if watermark is not None:
+        latest = max(latest, pl.select(pl.lit(watermark).str.strptime(pl.Datetime, format=CREATED_AT_FORMAT)).item())
+    write_watermark(state_dir, pl.select(pl.lit(latest).dt.strftime(CREATED_AT_FORMAT)).item())
+    return {
+        "orders_enriched": enriched,
+        "daily_city_sales": cube,
+        "location_sales": sales,
+        "top_5_city_recommendations": top5,
+        "top_10_product_pairs": top_pairs,
+        "monthly_product_margin": monthly_margin,
+        "margin_rollups": rollups
+    }
+
+# -----------------------------
+# 7. Bounded-memory mode
+# -----------------------------
+# working memory per byte of item CSV held in one partition (frame, join and group-by state)
+MEMORY_PER_CSV_BYTE = 2.0
+
+def n_partitions(items_path: str, memory_budget_mb: float) -> int:
+    return max(1, math.ceil(os.path.getsize(items_path) * MEMORY_PER_CSV_BYTE / (memory_budget_mb * 2**20)))
+
+def spill_partitions(frames: dict, n: int, spill_dir: str) -> list:
+    """
+    Lazy sinks splitting every frame (name -> (LazyFrame, order key)) into n Parquet files
+    by a hash of its order key, so an order and its items land in the same partition.
+    """
+    sinks = []
+    for name, (lf, key) in frames.items():
+        os.makedirs(os.path.join(spill_dir, name), exist_ok=True)
+        sinks += [lf.filter(pl.col(key).hash(seed=0) % n == i)
+                    .sink_parquet(os.path.join(spill_dir, name, f"part-{i}.parquet"), lazy=True)
+                  for i in range(n)]
+    return sinks
+
+def margin_sums(lines):
+    """Mergeable monthly margin state of one partition."""
+    return margin_lines(lines).group_by(STATE_KEYS).agg([
+        pl.sum('margin').alias('margin_sum'),
+        pl.col('margin').count().alias('margin_count')
+    ])
+
+def merge_margins(monthly: list, daily: list) -> tuple:
+    """Monthly product margin and margin rollups from the margin_sums / daily_margin states of disjoint partitions."""
+    monthly_margin = pl.concat(monthly).group_by(STATE_KEYS).agg(pl.sum('margin_sum'), pl.sum('margin_count')) \
+                       .select(STATE_KEYS + [(pl.col('margin_sum') / pl.col('margin_count')).alias('avg_margin')]) \
+                       .sort(STATE_KEYS)
+    rollups = margin_rollups(pl.concat(daily).group_by(DAILY_KEYS).agg(pl.sum('margin_sum'), pl.sum('margin_count')))
+    return monthly_margin, rollups
+
+@task
+@instrumented(volume=FILE_INPUTS)
+def run_streaming_pipeline(orders_path: str, items_path: str, postal_df: pl.DataFrame, writer: OutputWriter,
+                           memory_budget_mb: float = 2048, pairs_min_support: float = 0.0,
+                           pairs_max_basket_size: int | None = None, sketch_capacity: int = 10_000,
+                           triples: bool = False, stores: dict = DEFAULT_STORES, radius_km: float = 50,
+                           city_aliases: dict = CITY_ALIASES, compact_keys: bool = True):
+    """
+    For item files larger than memory. One streaming pass over the CSVs writes items_cleaned
+    and spills orders and items to disk in order-key hash partitions sized to memory_budget_mb.
+    Each partition then holds whole orders, so order values come out exact partition by
+    partition and the monthly margin is merged from per-partition sums and counts.
+    Only order-level frames are kept in memory; product pairs (and triples) use the
+    bounded-memory sketch over the spilled items.
+    """
+    n = n_partitions(items_path, memory_budget_mb)
+    spill_dir = os.path.join(writer.output_dir, "spill")
+    shutil.rmtree(spill_dir, ignore_errors=True)
+    orders, items = clean_orders_items(pl.scan_csv(orders_path), pl.scan_csv(items_path), compact_keys)
+    try:
+        sinks = spill_partitions({"orders": (orders, 'pk_sales_order'), "items": (items, 'fk_sales_order')}, n, spill_dir)
+        pl.collect_all(sinks + writer.sink("items_cleaned", items), engine='streaming')
+        writer.register("items_cleaned")
+
+        valued, margins, daily, baskets = [], [], [], []
+        os.makedirs(os.path.join(spill_dir, "baskets"), exist_ok=True)
+        for i in range(n):
+            part_orders = pl.read_parquet(os.path.join(spill_dir, "orders", f"part-{i}.parquet"))
+            part_lines = order_lines(pl.read_parquet(os.path.join(spill_dir, "items", f"part-{i}.parquet")), part_orders)
+            valued.append(with_order_values(part_orders, part_lines))
+            margins.append(margin_sums(part_lines))
+            daily.append(daily_margin(part_lines))
+            # the partitions hold whole orders, so their basket lines are the sketch's chunks as they are
+            baskets.append(os.path.join(spill_dir, "baskets", f"part-{i}.parquet"))
+            basket_lines(part_lines).select(['fk_sales_order', 'fk_item']).write_parquet(baskets[-1])
+        valued = pl.concat(valued)
+        monthly_margin, rollups = merge_margins(margins, daily)
+        enriched = with_cities(valued, postal_df, city_aliases)
+
+        lines = [pl.scan_parquet(path) for path in baskets]
+        top_pairs = frequent_itemsets_streaming(lines, 10, 2, sketch_capacity, n, pairs_min_support, pairs_max_basket_size)
+        if triples:
+            writer.write("top_10_product_triples",
+                         frequent_itemsets_streaming(lines, 10, 3, sketch_capacity, n, pairs_min_support, pairs_max_basket_size))
+    finally:
+        shutil.rmtree(spill_dir, ignore_errors=True)
+
+    cube = daily_city_sales(enriched)
+    results = {
+        "orders_cleaned": valued.drop('order_value'),
+        "orders_enriched": enriched,
+        "daily_city_sales": cube,
+        "location_bins": location_bins(cube),
+        "top_5_city_recommendations": store_candidates(enriched, stores, radius_km),
+        "top_10_product_pairs": top_pairs,
+        "monthly_product_margin": monthly_margin
+    }
+    for name, df in results.items():
+        writer.write(name, df)
+    write_margin_rollups(writer, rollups)
+    return {**results, "margin_rollups": rollups}
+
+# -----------------------------
+# 8. Sharded mode
+# -----------------------------
+def shards_for(orders_path: str, shard_by: str = "country", n_shards: int = 4) -> list:
+    """One shard per country code of the orders, or n_shards hash partitions of the order key."""
+    if shard_by == "country":
+        codes = normalize_columns(pl.scan_csv(orders_path)).select(pl.col('country_code').unique().sort()).collect()
+        return [("country", code) for code in codes['country_code'].to_list()]
+    if shard_by == "hash":
+        return [("hash", i, n_shards) for i in range(n_shards)]
+    raise ValueError(f"shard_by must be 'country' or 'hash', got {shard_by!r}")
+
+def shard_filter(shard: tuple) -> pl.Expr:
+    if shard[0] == "country":
+        return pl.col('country_code').is_null() if shard[1] is None else pl.col('country_code') == shard[1]
+    _, i, n = shard
+    return pl.col('pk_sales_order').hash(seed=0) % n == i
+
+def shard_frame(name: str, df: pl.DataFrame) -> pl.DataFrame:
+    # frames leave the worker with plain string keys, Categorical mappings are per process
+    return conform(name, df)
+
+def process_shard(orders_path: str, items_path: str, shard: tuple, postal_df: pl.DataFrame,
+                  city_aliases: dict = CITY_ALIASES, compact_keys: bool = True,
+                  pairs_max_basket_size: int | None = None) -> dict:
+    """
+    Runs in a worker process: the orders of one shard (whole orders, so order values and
+    baskets are complete) and their mergeable partial aggregates.
+    """
+    with measure(f"shard {shard[1]}" if shard[0] == "country" else f"shard {shard[1]}/{shard[2]}") as record:
+        orders, items = clean_orders_items(pl.scan_csv(orders_path), pl.scan_csv(items_path), compact_keys)
+        orders = orders.filter(shard_filter(shard)).collect()
+        lines = order_lines(items, orders.lazy()).collect()
+        enriched = with_cities(with_order_values(orders, lines), postal_df, city_aliases)
+        record['rows_in'], record['rows_out'] = lines.height, orders.height
+        partial = {
+            "orders_cleaned": shard_frame("orders_cleaned", orders),
+            "orders_enriched": shard_frame("orders_enriched", enriched),
+            "daily_city_sales": shard_frame("daily_city_sales", daily_city_sales(enriched)),
+            "margin": shard_frame("margin", margin_sums(lines)),
+            "daily_margin": shard_frame("daily_margin", daily_margin(lines)),
+            "pairs": pair_counts(basket_lines(lines), pairs_max_basket_size)
+        }
+    return {**partial, "metrics": record}
+
+@task
+@instrumented(volume=FILE_INPUTS)
+def run_sharded_pipeline(orders_path: str, items_path: str, postal_df: pl.DataFrame, writer: OutputWriter,
+                         shard_by: str = "country", n_shards: int = 4, max_workers: int | None = None,
+                         pairs_min_support: float = 0.0, pairs_max_basket_size: int | None = None,
+                         stores: dict = DEFAULT_STORES, radius_km: float = 50,
+                         city_aliases: dict = CITY_ALIASES, compact_keys: bool = True):
+    """
+    Processes each shard (country, or hash partition of pk_sales_order) in its own process.
+    Shards return partial aggregates: the daily city cube's sums and counts (AOV), margin
+    sums and counts, and exact pair counts. They are merged here into the same outputs as
+    the single-process run. Order-level frames are concatenated. items_cleaned is written
+    while the shards run.
+    """
+    shards = shards_for(orders_path, shard_by, n_shards)
+    workers = max_workers or min(len(shards), os.cpu_count() or 1)
+    # spawn: forking a process that already runs Polars' thread pool can deadlock
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = [pool.submit(process_shard, orders_path, items_path, shard, postal_df, city_aliases,
+                               compact_keys, pairs_max_basket_size) for shard in shards]
+        _, items = clean_orders_items(pl.scan_csv(orders_path), pl.scan_csv(items_path), compact_keys)
+        pl.collect_all(writer.sink("items_cleaned", items))
+        writer.register("items_cleaned")
+        partials = [f.result() for f in futures]
+    attach('shards', [p["metrics"] for p in partials])
+
+    def merged(name):
+        return compact_types(pl.concat([p[name] for p in partials]), compact_keys)
+
+    enriched = merged("orders_enriched")
+    cube = merged("daily_city_sales").group_by(['date', 'place_name', 'latitude', 'longitude']).agg([
+        pl.sum('order_count'), pl.sum('order_value_sum'), pl.sum('order_value_count')
+    ]).sort(['date', 'place_name', 'latitude', 'longitude'])
+    monthly_margin, rollups = merge_margins([merged("margin")], [merged("daily_margin")])
+
+    results = {
+        "orders_cleaned": merged("orders_cleaned"),
+        "orders_enriched": enriched,
+        "daily_city_sales": cube,
+        "location_bins": location_bins(cube),
+        # the cube's per-location order value sums are the sales store_candidates adds up
+        "top_5_city_recommendations": store_candidates(cube.rename({'order_value_sum': 'order_value'}), stores, radius_km),
+        "top_10_product_pairs": merge_pair_counts([p["pairs"] for p in partials], 10, pairs_min_support),
+        "monthly_product_margin": monthly_margin
+    }
+    for name, df in results.items():
+        writer.write(name, df)
+    write_margin_rollups(writer, rollups)
+    return {**results, "margin_rollups": rollups}
+
 # -----------------------------
-# 6. Prefect ETL flow
+# 9. Task result caching
 # -----------------------------
-@flow
+def file_sha256(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def input_fingerprint(orders_path: str, items_path: str, postal_df: pl.DataFrame) -> str:
+    """Content hash of everything the analyses are derived from."""
+    return hash_objects(file_sha256(orders_path), file_sha256(items_path),
+                        postal_df.hash_rows(seed=0).to_numpy().tobytes().hex())
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def is_project_code(obj) -> bool:
+    module = sys.modules.get(getattr(obj, '__module__', None) or "")
+    return os.path.dirname(os.path.abspath(getattr(module, '__file__', None) or "")) == SRC_DIR
+
+def code_names(code) -> set:
+    # names read by a function, its nested functions and lambdas
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            names |= code_names(const)
+    return names
+
+@functools.cache
+def code_fingerprint(fn) -> str:
+    """
+    Hash of the source of fn and, transitively, of the project functions and classes it
+    references (also through its annotations) and the project constants it reads, so a
+    change in a helper such as store_candidates invalidates the tasks that call it.
+    """
+    seen, parts, stack = set(), [], [fn]
+    while stack:
+        obj = inspect.unwrap(stack.pop())
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        if inspect.isclass(obj):
+            parts.append(inspect.getsource(obj))
+            stack += [m for m in vars(obj).values() if inspect.isfunction(m)]
+            continue
+        parts.append(inspect.getsource(obj))
+        refs = [obj.__globals__[n] for n in sorted(code_names(obj.__code__)) if n in obj.__globals__]
+        refs += [t for t in obj.__annotations__.values() if inspect.isclass(t)]
+        for ref in refs:
+            if inspect.isfunction(ref) or inspect.isclass(ref):
+                if is_project_code(inspect.unwrap(ref)):
+                    stack.append(ref)
+            elif isinstance(ref, (bool, int, float, str, tuple, list, dict, set, frozenset)):
+                parts.append(repr(ref))
+    return hash_objects(*parts)
+
+def task_cache_key(fingerprint: str, t, args: tuple, upstream: list = ()) -> str:
+    """
+    Cache key of calling task t with args = input content hash + the code of the task and
+    of the project helpers it calls + its non-frame arguments + the keys of the upstream
+    tasks whose frames it reads. Frame arguments are identified by the key of the task that
+    produced them, so a changed upstream parameter or helper recomputes everything downstream of it.
+    """
+    bound = inspect.signature(t.fn).bind(*args)
+    bound.apply_defaults()
+    scalars = {
+        k: vars(v) if isinstance(v, OutputWriter) else v
+        for k, v in bound.arguments.items() if not isinstance(v, (pl.DataFrame, pl.LazyFrame))
+    }
+    return hash_objects(fingerprint, t.name, code_fingerprint(t.fn), scalars, list(upstream))
+
+# cached task results, under output_dir
+RESULTS_DIR = "task_results"
+
+def prune_results(output_dir: str):
+    """
+    Drops the cached task results no output in the manifest was written from, so the storage
+    holds one result per cached task instead of growing with every input and parameter set.
+    """
+    results_dir = os.path.join(output_dir, RESULTS_DIR)
+    if not os.path.isdir(results_dir):
+        return
+    outputs = (read_manifest(output_dir) or {}).get('outputs') or {}
+    keys = {entry.get('cache_key') for entry in outputs.values()}
+    for name in os.listdir(results_dir):
+        if name not in keys and os.path.isfile(os.path.join(results_dir, name)):
+            os.remove(os.path.join(results_dir, name))
+
+# -----------------------------
+# 10. Prefect ETL flow
+# -----------------------------
+def write_run_metrics(flow, flow_run, state):
+    """
+    Flow hook: writes the task metrics of the run (also when it failed), appends them to
+    the run history and warns about tasks whose runtime grows faster than their input.
+    """
+    params = {**{k: p.default for k, p in inspect.signature(flow.fn).parameters.items()}, **flow_run.parameters}
+    metrics = finish_run(params['output_dir'], state.type.value.lower())
+    if metrics is None:
+        return
+    print(f"Run metrics written to {os.path.join(params['output_dir'], METRICS_FILE)}")
+
+    history_db = os.path.join(params['output_dir'], HISTORY_FILE)
+    input_bytes = sum(os.path.getsize(p) for p in [params['orders_path'], params['items_path']] if os.path.exists(p))
+    record_run(history_db, metrics, input_bytes, params)
+    for task, found in growth_warnings(history_db).items():
+        print(f"WARNING: {task}: {'; '.join(found)} (python src/run_history.py for the trend)")
+
+@flow(task_runner=ThreadPoolTaskRunner(max_workers=4), on_completion=[write_run_metrics], on_failure=[write_run_metrics])
 def gymbeam_etl_flow(
     orders_path="../data/in/sales_order.csv", 
     items_path="../data/in/sales_order_item.csv", 
-    output_dir="../data/out"
+    output_dir="../data/out",
+    lazy: bool = False,
+    streaming: bool = False,
+    memory_budget_mb: float = 2048,
+    sharded: bool = False,
+    shard_by: str = "country",
+    n_shards: int = 4,
+    shard_workers: int | None = None,
+    postal_cache_dir="../data/cache/postal_codes",
+    postal_ttl_hours: float = 24 * 7,
+    offline: bool = False,
+    pairs_min_support: float = 0.0,
+    pairs_max_basket_size: int | None = None,
+    pairs_approximate: bool | None = None,
+    pairs_sketch_capacity: int = 10_000,
+    pairs_chunks: int | None = None,
+    product_triples: bool = False,
+    stores: dict = DEFAULT_STORES,
+    store_radius_km: float = 50,
+    n_new_stores: int = 0,
+    city_aliases: dict = CITY_ALIASES,
+    compact_keys: bool = True,
+    incremental: bool = False,
+    lookback_days: int = 0,
+    output_format: str = "parquet",
+    csv_export: bool = False,
+    use_cache: bool = True,
+    refresh_cache: bool = False,
+    metrics: bool = True,
+    capture_query_plans: bool = False
 ):
     """
     Main ETL pipeline for GymBeam sales data.
     Loads, cleans, enriches and analyzes sales data.
     Saves all results to the 'data/out' directory.
+    With lazy=True the whole pipeline is planned lazily and collected once.
+    streaming=True processes the items in hash partitions spilled to disk, sized so one
+    partition fits memory_budget_mb; product pairs then always use the sketch with the
+    partitions as its chunks, pairs_approximate=False or pairs_chunks raise a ValueError.
+    sharded=True runs every country (shard_by='country') or n_shards hash partitions of
+    the order key (shard_by='hash') in its own process and merges their partial aggregates;
+    product pairs are then counted exactly, the sketch options (pairs_approximate,
+    pairs_chunks, product_triples) raise a ValueError.
+    Postal codes come from a local cache; offline=True never touches the network.
+    pairs_approximate=True counts product pairs (and triples) with a bounded-memory sketch
+    over pairs_chunks chunks of the orders (PAIR_CHUNKS unless given).
+    stores / store_radius_km define existing store coverage; n_new_stores > 0 also runs
+    the greedy new-store placement over all postal codes.
+    city_aliases maps place name prefixes (districts, suburbs) to their city.
+    compact_keys=True packs the 32 character lower-case hex order keys into UInt128 while
+    processing (decoded again on export) and fails with a ValueError on any other key;
+    turn it off for keys in another format.
+    incremental=True only processes orders newer than the stored created_at watermark.
+    Outputs are written as output_format ('parquet', 'ipc' or 'csv'); csv_export=True
+    also writes the CSV files next to the columnar ones.
+    In the default mode the analysis results are cached on the input content hash (use_cache,
+    refresh_cache) in output_dir/task_results, which keeps only the results of the current
+    outputs, and the independent analyses run concurrently.
+    metrics=True writes time, CPU, peak memory, rows and bytes of every executed task to
+    run_metrics.json in output_dir (capture_query_plans=True adds the lazy plans) and
+    appends them to the run history in run_history.sqlite.
     """
-    postal_urls = {
-        "SK":"https://github.com/zauberware/postal-codes-json-xml-csv/raw/master/data/SK.zip",
-        "CZ":"https://github.com/zauberware/postal-codes-json-xml-csv/raw/master/data/CZ.zip",
-        "HU":"https://github.com/zauberware/postal-codes-json-xml-csv/raw/master/data/HU.zip"
-    }
-
-    postal_dfs = [download_postal_codes_github(url, c) for c, url in postal_urls.items()]
-    postal_df = pl.concat(postal_dfs)
-
-    orders, items = load_clean_orders_items(orders_path, items_path, output_dir)
-    orders = calculate_order_values(orders, items)
-    orders = enrich_orders_with_cities(orders, postal_df, output_dir)
-    top5 = top_5_store_candidates(orders, output_dir)
-    top_pairs = top_10_product_pairs(items, orders, output_dir)
-    monthly_margin = monthly_product_margin(items, orders, output_dir)
+    if sharded and not incremental and (pairs_approximate or pairs_chunks is not None or product_triples):
+        raise ValueError("sharded=True merges the exact pair counts of the shards, the sketch options "
+                         "pairs_approximate, pairs_chunks and product_triples are not supported with it")
+    if streaming and not (incremental or sharded) and (pairs_approximate is False or pairs_chunks is not None):
+        raise ValueError("streaming=True always counts product pairs with the sketch over its spill partitions "
+                         "(sized by memory_budget_mb), pairs_approximate=False and pairs_chunks are not supported with it")
+    pairs_approximate, pairs_chunks = bool(pairs_approximate), pairs_chunks or PAIR_CHUNKS
+    if metrics:
+        start_run(capture_query_plans)
+    writer = OutputWriter(output_dir, output_format, csv_export)
+    postal_df = load_postal_codes(POSTAL_URLS, postal_cache_dir, postal_ttl_hours, offline)
+
+    if incremental:
+        results = run_incremental_update(orders_path, items_path, postal_df, writer,
+                                         lookback_days, stores, store_radius_km, city_aliases, compact_keys,
+                                         pairs_min_support, pairs_max_basket_size, pairs_approximate,
+                                         pairs_sketch_capacity, pairs_chunks, product_triples)
+        if results is None:
+            return None
+        # only the touched months; new store placement uses the sales state over all of them
+        orders = results["orders_enriched"]
+        demand = results["location_sales"]
+        top5 = results["top_5_city_recommendations"]
+        # only written by the full rebuild of the first run
+        top_pairs = results["top_10_product_pairs"]
+        monthly_margin = results["monthly_product_margin"]
+    elif sharded:
+        results = run_sharded_pipeline(orders_path, items_path, postal_df, writer, shard_by, n_shards, shard_workers,
+                                       pairs_min_support, pairs_max_basket_size, stores, store_radius_km,
+                                       city_aliases, compact_keys)
+        orders = results["orders_enriched"]
+        top5 = results["top_5_city_recommendations"]
+        top_pairs = results["top_10_product_pairs"]
+        monthly_margin = results["monthly_product_margin"]
+    elif streaming:
+        results = run_streaming_pipeline(orders_path, items_path, postal_df, writer, memory_budget_mb,
+                                         pairs_min_support, pairs_max_basket_size, pairs_sketch_capacity,
+                                         product_triples, stores, store_radius_km, city_aliases, compact_keys)
+        orders = results["orders_enriched"]
+        top5 = results["top_5_city_recommendations"]
+        top_pairs = results["top_10_product_pairs"]
+        monthly_margin = results["monthly_product_margin"]
+    elif lazy:
+        results = run_lazy_pipeline(orders_path, items_path, postal_df, writer,
+                                    pairs_min_support, pairs_max_basket_size, pairs_approximate,
+                                    stores, store_radius_km, city_aliases, compact_keys)
+        orders = results["orders_enriched"]
+        top5 = results["top_5_city_recommendations"]
+        if pairs_approximate:
+            # the sketch streams over the scanned items itself instead of joining the collected plan
+            _, items = clean_orders_items(pl.scan_csv(orders_path), pl.scan_csv(items_path), compact_keys)
+            top_pairs = top_10_product_pairs(order_lines(items, orders.lazy()), writer, pairs_min_support, pairs_max_basket_size,
+                                             True, pairs_sketch_capacity, pairs_chunks, product_triples)
+        else:
+            top_pairs = results["top_10_product_pairs"]
+        monthly_margin = results["monthly_product_margin"]
+    else:
+        keys = {}
+        def cached(t, *upstream, outputs=(), persist=True, submit=False):
+            """
+            t cached under task_cache_key of the arguments it is called with; upstream are the
+            tasks whose frames it reads, they have run (and stored their keys) by now. A cache
+            hit doesn't write its outputs, so t recomputes unless they were last written under its key.
+            persist=False (the order and line frames) keeps the result out of the result storage:
+            t always runs and only skips rewriting outputs already written under its key.
+            """
+            def run(*args):
+                if not use_cache:
+                    return t.submit(*args) if submit else t(*args)
+                key = keys[t.name] = task_cache_key(fingerprint, t, args, [keys[u.name] for u in upstream])
+                args = [writer.keyed(key) if arg is writer else arg for arg in args]
+                if not persist:
+                    return t(*args)
+                keyed = t.with_options(cache_key_fn=lambda context, parameters: key, persist_result=True,
+                                       result_storage=result_storage,
+                                       refresh_cache=refresh_cache or not writer.has_outputs(outputs, key),
+                                       on_completion=[record_cache_hit])
+                return keyed.submit(*args) if submit else keyed(*args)
+            return run
+
+        fingerprint = input_fingerprint(orders_path, items_path, postal_df) if use_cache else None
+        # a Path is local storage that needs no saved storage block
+        result_storage = Path(output_dir, RESULTS_DIR).resolve()
+        # the full order and line frames would grow the result storage by their size for every input
+        orders, items = cached(load_clean_orders_items, persist=False)(orders_path, items_path, writer, compact_keys)
+        lines = cached(build_order_lines, load_clean_orders_items, persist=False)(orders, items)
+        orders = cached(calculate_order_values, load_clean_orders_items, build_order_lines, persist=False)(orders, lines)
+        orders = cached(enrich_orders_with_cities, calculate_order_values, persist=False)(orders, postal_df, writer, city_aliases)
+
+        # independent of each other, only read the cleaned and enriched frames
+        cube_future = cached(daily_city_cube, enrich_orders_with_cities, outputs=["daily_city_sales", "location_bins"],
+                             submit=True)(orders, writer)
+        top5_future = cached(top_5_store_candidates, enrich_orders_with_cities, outputs=["top_5_city_recommendations"],
+                             submit=True)(orders, writer, stores, store_radius_km)
+        pair_outputs = ["top_10_product_pairs"] + (["top_10_product_triples"] if pairs_approximate and product_triples else [])
+        pairs_future = cached(top_10_product_pairs, build_order_lines, outputs=pair_outputs, submit=True)(
+            lines, writer, pairs_min_support, pairs_max_basket_size,
+            pairs_approximate, pairs_sketch_capacity, pairs_chunks, product_triples)
+        margin_future = cached(monthly_product_margin, build_order_lines, outputs=["monthly_product_margin"],
+                               submit=True)(lines, writer)
+        rollups_future = cached(product_margin_rollups, build_order_lines, outputs=["margin_rollups", "margin_rollups_index"],
+                                submit=True)(lines, writer)
+        cube_future.result(), rollups_future.result()
+        top5, top_pairs, monthly_margin = top5_future.result(), pairs_future.result(), margin_future.result()
+        prune_results(output_dir)
+
+    if n_new_stores:
+        new_store_locations(demand if incremental else orders, postal_df, writer, n_new_stores, stores, store_radius_km)
 
     print("ETL flow completed successfully. Files are now in the 'data/out' directory.")
     return orders, top5, top_pairs, monthly_margin
@@ -0,0 +1,91 @@
+# incremental.py
+import polars as pl
+import json
+import os
+
+CREATED_AT_FORMAT = "%Y-%m-%d %H:%M:%S%.f"
+STATE_KEYS = ['fk_item', 'year_month']
+DAILY_KEYS = ['fk_item', 'date']
+
+# -----------------------------
+# 1. Watermark
+# -----------------------------
+def read_watermark(state_dir: str):
+    path = os.path.join(state_dir, "watermark.json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)['created_at']
+
+def write_watermark(state_dir: str, created_at: str):
+    os.makedirs(state_dir, exist_ok=True)
+    tmp = os.path.join(state_dir, "watermark.json.tmp")
+    with open(tmp, "w") as f:
+        json.dump({'created_at': created_at}, f)
+    os.replace(tmp, os.path.join(state_dir, "watermark.json"))
+
+# -----------------------------
+# 2. Upserts
+# -----------------------------
+def upsert(existing: pl.DataFrame | None, new: pl.DataFrame, keys: list) -> pl.DataFrame:
+    """Replaces rows of `existing` whose keys appear in `new` and appends the rest."""
+    if existing is None:
+        return new
+    return pl.concat([existing.join(new.select(keys), on=keys, how='anti'), new.select(existing.columns)])
+
+def _ledger_path(state_dir: str, month) -> str:
+    return os.path.join(state_dir, "margin_ledger", f"{month:%Y-%m}.parquet")
+
+def update_margin_ledger(state_dir: str, contributions: pl.DataFrame, orders: pl.Series, months: list) -> pl.DataFrame:
+    """
+    The ledger keeps each order's (fk_item, year_month) margin sum/count, one Parquet
+    file per month, so reprocessed orders can be backed out of the monthly state.
+    Only the given months are read and rewritten. Returns the replaced contributions.
+    """
+    os.makedirs(os.path.join(state_dir, "margin_ledger"), exist_ok=True)
+    replaced = []
+    for month in months:
+        path = _ledger_path(state_dir, month)
+        new = contributions.filter(pl.col('year_month') == month)
+        if os.path.exists(path):
+            ledger = pl.read_parquet(path)
+            replaced.append(ledger.filter(pl.col('fk_sales_order').is_in(orders.implode())))
+            new = pl.concat([ledger.filter(~pl.col('fk_sales_order').is_in(orders.implode())), new])
+        new.write_parquet(path)
+    return pl.concat(replaced) if replaced else contributions.clear()
+
+def merge_margin_state(state_dir: str, added: pl.DataFrame, removed: pl.DataFrame,
+                       keys: list = STATE_KEYS, name: str = "margin_state") -> pl.DataFrame:
+    """
+    Margin state holds margin_sum / margin_count per (fk_item, year_month), or per the
+    given keys, which unlike avg_margin can be merged. Returns the updated state.
+    """
+    path = os.path.join(state_dir, f"{name}.parquet")
+    dtypes = {'margin_sum': pl.Float64, 'margin_count': pl.Int64}
+    parts = [
+        added.cast(dtypes).group_by(keys).agg([pl.sum('margin_sum'), pl.sum('margin_count')]),
+        removed.cast(dtypes).group_by(keys).agg([-pl.sum('margin_sum'), -pl.sum('margin_count')])
+    ]
+    if os.path.exists(path):
+        parts.insert(0, pl.read_parquet(path))
+
+    state = pl.concat(parts) \
+              .group_by(keys).agg([pl.sum('margin_sum'), pl.sum('margin_count')]) \
+              .filter(pl.col('margin_count') > 0) \
+              .sort(keys)
+    state.write_parquet(path)
+    return state
+
+def update_location_sales(state_dir: str, sales: pl.DataFrame, months: list | None = None) -> pl.DataFrame:
+    """
+    Order value per (year_month, delivery location), so store candidates and map bins cover
+    the whole history without reading it. Replaces the given months ('YYYY-MM'), all of
+    them when months is None. Returns the updated state.
+    """
+    path = os.path.join(state_dir, "location_sales.parquet")
+    if months is not None and os.path.exists(path):
+        kept = pl.read_parquet(path).filter(~pl.col('year_month').is_in(months))
+        sales = pl.concat([kept, sales.select(kept.columns)])
+    os.makedirs(state_dir, exist_ok=True)
+    sales.write_parquet(path)
+    return sales
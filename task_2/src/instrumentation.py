@@ -0,0 +1,176 @@
+# instrumentation.py
+import polars as pl
+import functools
+import inspect
+import json
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+METRICS_FILE = "run_metrics.json"
+
+# the record of the task running in this thread, for add_bytes() / attach()
+_current = ContextVar('task_metrics', default=None)
+_active_run = None
+
+# -----------------------------
+# 1. Measuring
+# -----------------------------
+def current_rss() -> int:
+    """Resident set size of this process in bytes."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # no procfs (macOS): fall back to the peak so far, reported in bytes there
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+@contextmanager
+def measure(task: str, results: list | None = None, interval: float = 0.005):
+    """
+    Records wall time, CPU time and peak RSS of the block. Polars allocates outside the
+    Python heap, so the peak comes from sampling the process RSS in a background thread.
+    RSS and CPU time are process wide, so tasks running concurrently see each other's usage.
+    The block can fill in rows_in / input_bytes / rows_out; the record is appended to `results`.
+    """
+    record = {'task': task, 'rows_in': None, 'input_bytes': None, 'rows_out': None, 'bytes_written': 0}
+    token = _current.set(record)
+    start_rss = peak = current_rss()
+    done = threading.Event()
+
+    def sample():
+        nonlocal peak
+        while not done.wait(interval):
+            peak = max(peak, current_rss())
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    started, wall, cpu = time.time(), time.perf_counter(), time.process_time()
+    try:
+        yield record
+        record['status'] = 'ok'
+    except Exception as exc:
+        record['status'] = 'failed'
+        record['error'] = f"{type(exc).__name__}: {exc}"
+        raise
+    finally:
+        done.set()
+        sampler.join()
+        _current.reset(token)
+        peak = max(peak, current_rss())
+        record.update({
+            'started_at': started,
+            'wall_s': round(time.perf_counter() - wall, 4),
+            'cpu_s': round(time.process_time() - cpu, 4),
+            'peak_rss_mb': round(peak / 2**20, 1),
+            'peak_rss_delta_mb': round((peak - start_rss) / 2**20, 1)
+        })
+        if results is not None:
+            results.append(record)
+
+def add_bytes(n: int):
+    """Counts bytes written by the task running in this thread (called by OutputWriter)."""
+    record = _current.get()
+    if record is not None:
+        record['bytes_written'] += n
+
+def attach(key: str, value):
+    """Adds a value (e.g. a query plan) to the record of the task running in this thread."""
+    record = _current.get()
+    if record is not None:
+        record[key] = value
+
+def rows(value) -> int | None:
+    """Row count of a frame or of the frames in a tuple/dict; None for lazy or other values."""
+    if isinstance(value, pl.DataFrame):
+        return value.height
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, (tuple, list)):
+        counts = [rows(v) for v in value]
+        counts = [c for c in counts if c is not None]
+        return sum(counts) if counts else None
+    return None
+
+# -----------------------------
+# 2. Run metrics
+# -----------------------------
+class RunMetrics:
+    """Task records of one flow run, written as a JSON artifact next to the outputs."""
+    def __init__(self, capture_plans: bool = False):
+        self.started_at = time.time()
+        self.capture_plans = capture_plans
+        self.tasks = []
+
+    def to_dict(self, status: str) -> dict:
+        return {
+            'started_at': self.started_at,
+            'finished_at': time.time(),
+            'wall_s': round(time.time() - self.started_at, 4),
+            'status': status,
+            'polars': pl.__version__,
+            'tasks': sorted(self.tasks, key=lambda r: r['started_at'])
+        }
+
+    def write(self, output_dir: str, status: str) -> dict:
+        metrics = self.to_dict(status)
+        os.makedirs(output_dir, exist_ok=True)
+        path = os.path.join(output_dir, METRICS_FILE)
+        with open(path + ".tmp", "w") as f:
+            json.dump(metrics, f, indent=2)
+        os.replace(path + ".tmp", path)
+        return metrics
+
+def start_run(capture_plans: bool = False) -> RunMetrics:
+    global _active_run
+    _active_run = RunMetrics(capture_plans)
+    return _active_run
+
+def active_run() -> RunMetrics | None:
+    return _active_run
+
+def finish_run(output_dir: str, status: str) -> dict | None:
+    global _active_run
+    run, _active_run = _active_run, None
+    return run.write(output_dir, status) if run is not None else None
+
+def capture_plans() -> bool:
+    return _active_run is not None and _active_run.capture_plans
+
+def record_cache_hit(task, task_run, state):
+    """Task hook: a task served from the cache never runs its function, list it as cached."""
+    if _active_run is not None and state.name == 'Cached':
+        _active_run.tasks.append({'task': task.fn.__name__, 'status': 'cached', 'started_at': time.time()})
+
+def input_volume(fn, volume: tuple, args: tuple, kwargs: dict) -> tuple:
+    """(rows, bytes) of the arguments named in volume: rows of the frames, size of the files."""
+    bound = inspect.signature(fn).bind_partial(*args, **kwargs).arguments
+    values = [bound[name] for name in volume if name in bound]
+    paths = [v for v in values if isinstance(v, str) and os.path.isfile(v)]
+    return rows(values), (sum(os.path.getsize(p) for p in paths) if paths else None)
+
+def instrumented(fn=None, *, volume: tuple = ()):
+    """
+    Measures every call of a task function while a run is active: time, CPU, peak RSS,
+    rows of the result, bytes the task wrote and the task's input volume. volume names
+    the arguments its cost scales with: frames (their rows become rows_in) or input
+    files (their size becomes input_bytes). Lookup tables such as the postal codes stay out.
+    Outside a run (or for a task served from the cache) nothing is recorded.
+    """
+    if fn is None:
+        return functools.partial(instrumented, volume=volume)
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        run = _active_run
+        if run is None:
+            return fn(*args, **kwargs)
+        with measure(fn.__name__, run.tasks) as record:
+            record['rows_in'], record['input_bytes'] = input_volume(fn, volume, args, kwargs)
+            result = fn(*args, **kwargs)
+            record['rows_out'] = rows(result)
+        return result
+    return wrapper
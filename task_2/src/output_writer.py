@@ -0,0 +1,347 @@
+# output_writer.py
+import polars as pl
+import copy
+import glob
+import json
+import os
+import shutil
+import threading
+import time
+from instrumentation import add_bytes
+from compact import decoded
+
+# bump when a column is added, removed or changes type in SCHEMAS
+SCHEMA_VERSION = 3
+
+EXTENSIONS = {'parquet': '.parquet', 'ipc': '.arrow', 'csv': '.csv'}
+
+ORDER_SCHEMA = {
+    'pk_sales_order': pl.Utf8,
+    'created_at': pl.Datetime('us'),
+    'currency': pl.Utf8,
+    'currency_rate': pl.Float64,
+    'country_code': pl.Utf8,
+    'postal_code': pl.Utf8
+}
+
+SCHEMAS = {
+    'orders_cleaned': ORDER_SCHEMA,
+    'orders_enriched': {
+        **ORDER_SCHEMA,
+        'order_value': pl.Float64,
+        'place_name': pl.Utf8,
+        'latitude': pl.Float64,
+        'longitude': pl.Float64
+    },
+    'items_cleaned': {
+        'product_price_local_currency': pl.Float64,
+        'sold_qty': pl.Float64,
+        'product_cost_eur': pl.Float64
+    },
+    'daily_city_sales': {
+        'date': pl.Date,
+        'place_name': pl.Utf8,
+        'latitude': pl.Float64,
+        'longitude': pl.Float64,
+        'order_count': pl.Int64,
+        'order_value_sum': pl.Float64,
+        'order_value_count': pl.Int64
+    },
+    'location_bins': {
+        'place_name': pl.Utf8,
+        'latitude': pl.Float64,
+        'longitude': pl.Float64,
+        'resolution_km': pl.Float64,
+        'bin_latitude': pl.Float64,
+        'bin_longitude': pl.Float64
+    },
+    'monthly_product_margin': {
+        'year_month': pl.Datetime('us'),
+        'avg_margin': pl.Float64
+    },
+    'margin_rollups': {
+        'fk_item': pl.Utf8,
+        'grain': pl.Utf8,
+        'period': pl.Date,
+        'margin_sum': pl.Float64,
+        'margin_count': pl.Int64
+    },
+    'margin_rollups_index': {
+        'fk_item': pl.Utf8,
+        'offset': pl.Int64,
+        'length': pl.Int64
+    },
+    'top_5_city_recommendations': {
+        'place_name': pl.Utf8,
+        'latitude': pl.Float64,
+        'longitude': pl.Float64,
+        'total_sales': pl.Float64,
+        'min_distance_km': pl.Float64
+    }
+}
+
+# datasets written as one file per month of this column
+PARTITIONS = {
+    'orders_cleaned': 'created_at',
+    'orders_enriched': 'created_at',
+    'daily_city_sales': 'date',
+    'monthly_product_margin': 'year_month'
+}
+
+_manifest_lock = threading.Lock()
+
+def month_key(col: str) -> pl.Expr:
+    """Partition key ('YYYY-MM', 'unknown' without a date) of a PARTITIONS column."""
+    return pl.col(col).dt.strftime('%Y-%m').fill_null('unknown')
+
+def conform(name: str, df):
+    """
+    Casts the known columns of an output to its declared schema (dates are parsed from strings).
+    Encoded order keys are decoded and Categorical columns exported as strings unless declared otherwise.
+    """
+    schema = df.collect_schema()
+    declared = SCHEMAS.get(name, {})
+    exprs = []
+    for col, current in schema.items():
+        dtype = declared.get(col, pl.Utf8 if current in (pl.UInt128, pl.Categorical) else current)
+        if current == dtype:
+            continue
+        if current == pl.UInt128 and dtype == pl.Utf8:
+            exprs.append(decoded(col))
+        elif current == pl.Utf8 and dtype == pl.Date:
+            exprs.append(pl.col(col).str.to_date())
+        elif current == pl.Utf8 and dtype.is_temporal():
+            exprs.append(pl.col(col).str.to_datetime(time_unit='us'))
+        else:
+            exprs.append(pl.col(col).cast(dtype))
+    return df.with_columns(exprs) if exprs else df
+
+class OutputWriter:
+    """
+    Writes the flow outputs as compressed Parquet or Arrow IPC (or plain CSV), partitioned
+    by month where the dataset has a date, and keeps a manifest.json with row counts,
+    schemas and the schema version. csv_export=True also writes the old CSV files.
+    A writer from keyed() also records the cache key of the task writing each output and
+    skips (in write) outputs already written under that key.
+    """
+    def __init__(self, output_dir: str, fmt: str = 'parquet', csv_export: bool = False):
+        if fmt not in EXTENSIONS:
+            raise ValueError(f"Unknown output format {fmt!r}, expected one of {list(EXTENSIONS)}")
+        self.output_dir = output_dir
+        self.fmt = fmt
+        self.csv_export = csv_export and fmt != 'csv'
+        self.cache_key = None
+
+    def keyed(self, cache_key: str) -> 'OutputWriter':
+        """This writer, recording cache_key in the manifest entry of every output it writes."""
+        writer = copy.copy(self)
+        writer.cache_key = cache_key
+        return writer
+
+    # -----------------------------
+    # writing
+    # -----------------------------
+    def _write_file(self, df: pl.DataFrame, path: str, fmt: str) -> int:
+        if fmt == 'parquet':
+            df.write_parquet(path, compression='zstd')
+        elif fmt == 'ipc':
+            df.write_ipc(path, compression='zstd')
+        else:
+            df.write_csv(path)
+        return os.path.getsize(path)
+
+    def _write_partition(self, path: str, key: str, part: pl.DataFrame) -> int:
+        os.makedirs(os.path.join(path, f"year_month={key}"), exist_ok=True)
+        return self._write_file(part, os.path.join(path, f"year_month={key}", "part-0" + EXTENSIONS[self.fmt]), self.fmt)
+
+    def write(self, name: str, df: pl.DataFrame) -> pl.DataFrame:
+        if self.cache_key is not None and self.has_outputs([name], self.cache_key):
+            # written by a task run with the same cache key: same input, code and parameters
+            return df
+        os.makedirs(self.output_dir, exist_ok=True)
+        df = conform(name, df)
+        partition_col = PARTITIONS.get(name) if self.fmt != 'csv' else None
+
+        if partition_col is None:
+            path = os.path.join(self.output_dir, name + EXTENSIONS[self.fmt])
+            nbytes = self._write_file(df, path, self.fmt)
+            partitions = None
+        else:
+            path = os.path.join(self.output_dir, name)
+            shutil.rmtree(path, ignore_errors=True)
+            keyed = df.with_columns(month_key(partition_col).alias('_partition'))
+            partitions, nbytes = {}, 0
+            # an empty dataset still gets one (empty) file so its schema can be read back
+            parts = keyed.partition_by('_partition', as_dict=True) or {('unknown',): keyed}
+            for (key,), part in sorted(parts.items()):
+                nbytes += self._write_partition(path, key, part.drop('_partition'))
+                partitions[key] = part.height
+
+        if self.csv_export:
+            nbytes += self._write_file(df, os.path.join(self.output_dir, f"{name}.csv"), 'csv')
+
+        add_bytes(nbytes)
+        self._record(name, {
+            'format': self.fmt,
+            'path': os.path.relpath(path, self.output_dir),
+            'rows': df.height,
+            'bytes': nbytes,
+            'schema': {c: str(t) for c, t in df.schema.items()},
+            'partitions': partitions
+        })
+        return df
+
+    def write_partitions(self, name: str, df: pl.DataFrame, months: list) -> pl.DataFrame:
+        """
+        Replaces only the given months ('YYYY-MM') of a partitioned dataset with the rows of df
+        and leaves the other partitions untouched. Datasets not yet partitioned on disk in
+        this format are merged and written whole. The CSV export is rebuilt from all partitions.
+        """
+        df = conform(name, df)
+        partition_col = PARTITIONS[name]
+        entry = ((read_manifest(self.output_dir) or {}).get('outputs') or {}).get(name)
+        if self.fmt == 'csv' or entry is None or entry['partitions'] is None or entry['format'] != self.fmt:
+            existing = scan_output(self.output_dir, name)
+            if existing is not None:
+                kept = existing.filter(~month_key(partition_col).is_in(months)).collect()
+                df = pl.concat([kept, df.select(kept.columns)])
+            return self.write(name, df)
+
+        path = os.path.join(self.output_dir, name)
+        parts = df.with_columns(month_key(partition_col).alias('_partition')).partition_by('_partition', as_dict=True)
+        partitions, nbytes = dict(entry['partitions']), 0
+        for key in set(months) | {key for (key,) in parts}:
+            shutil.rmtree(os.path.join(path, f"year_month={key}"), ignore_errors=True)
+            partitions.pop(key, None)
+        for (key,), part in sorted(parts.items()):
+            nbytes += self._write_partition(path, key, part.drop('_partition'))
+            partitions[key] = part.height
+
+        files = sorted(glob.glob(os.path.join(path, "*", "*")))
+        total = sum(os.path.getsize(f) for f in files)
+        if self.csv_export:
+            csv_bytes = self._write_file(conform(name, _scan_files(name, files, self.fmt)).collect(),
+                                         os.path.join(self.output_dir, f"{name}.csv"), 'csv')
+            nbytes, total = nbytes + csv_bytes, total + csv_bytes
+
+        add_bytes(nbytes)
+        self._record(name, {
+            **entry,
+            'rows': sum(partitions.values()),
+            'bytes': total,
+            'partitions': dict(sorted(partitions.items()))
+        })
+        return df
+
+    def sink(self, name: str, lf: pl.LazyFrame) -> list:
+        """
+        Lazy sinks for an unpartitioned dataset, to be run inside pl.collect_all.
+        Call register(name) once they have been collected.
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        lf = conform(name, lf)
+        path = os.path.join(self.output_dir, name + EXTENSIONS[self.fmt])
+        if self.fmt == 'parquet':
+            sinks = [lf.sink_parquet(path, compression='zstd', lazy=True)]
+        elif self.fmt == 'ipc':
+            sinks = [lf.sink_ipc(path, compression='zstd', lazy=True)]
+        else:
+            sinks = [lf.sink_csv(path, lazy=True)]
+        if self.csv_export:
+            sinks.append(lf.sink_csv(os.path.join(self.output_dir, f"{name}.csv"), lazy=True))
+        return sinks
+
+    def register(self, name: str):
+        path = os.path.join(self.output_dir, name + EXTENSIONS[self.fmt])
+        lf = _scan_files(name, [path], self.fmt)
+        nbytes = os.path.getsize(path)
+        if self.csv_export:
+            nbytes += os.path.getsize(os.path.join(self.output_dir, f"{name}.csv"))
+        add_bytes(nbytes)
+        self._record(name, {
+            'format': self.fmt,
+            'path': os.path.relpath(path, self.output_dir),
+            'rows': lf.select(pl.len()).collect().item(),
+            'bytes': nbytes,
+            'schema': {c: str(t) for c, t in lf.collect_schema().items()},
+            'partitions': None
+        })
+
+    def _record(self, name: str, entry: dict):
+        path = os.path.join(self.output_dir, "manifest.json")
+        with _manifest_lock:
+            manifest = read_manifest(self.output_dir) or {'outputs': {}}
+            manifest['schema_version'] = SCHEMA_VERSION
+            manifest['updated_at'] = time.time()
+            manifest['outputs'][name] = {**entry, 'cache_key': self.cache_key, 'written_at': time.time()}
+            with open(path + ".tmp", "w") as f:
+                json.dump(manifest, f, indent=2)
+            os.replace(path + ".tmp", path)
+
+    def has_outputs(self, names: list, cache_key: str | None = None) -> bool:
+        """
+        True if every named output exists on disk in this writer's format and, given a
+        cache_key, was last written under that key (by the task run it caches).
+        """
+        outputs = (read_manifest(self.output_dir) or {}).get('outputs') or {}
+        return all(
+            name in outputs and outputs[name]['format'] == self.fmt
+            and os.path.exists(os.path.join(self.output_dir, outputs[name]['path']))
+            and (cache_key is None or outputs[name].get('cache_key') == cache_key)
+            for name in names
+        )
+
+    # -----------------------------
+    # reading
+    # -----------------------------
+    def scan(self, name: str, months: list | None = None) -> pl.LazyFrame | None:
+        return scan_output(self.output_dir, name, months)
+
+    def read(self, name: str, months: list | None = None) -> pl.DataFrame | None:
+        lf = self.scan(name, months)
+        return None if lf is None else lf.collect()
+
+def _scan_files(name: str, files: list, fmt: str) -> pl.LazyFrame:
+    if fmt == 'parquet':
+        return pl.scan_parquet(files)
+    if fmt == 'ipc':
+        return pl.scan_ipc(files)
+    # CSV carries no types, read the declared ones (keeps e.g. leading zeros in postal codes)
+    return pl.scan_csv(files, schema_overrides=SCHEMAS.get(name))
+
+def read_manifest(output_dir: str) -> dict | None:
+    path = os.path.join(output_dir, "manifest.json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def output_version(output_dir: str, name: str) -> float | None:
+    """Changes whenever the output is rewritten: its manifest write time, or the mtime of an older run's CSV."""
+    entry = ((read_manifest(output_dir) or {}).get('outputs') or {}).get(name)
+    if entry is not None:
+        return entry['written_at']
+    path = os.path.join(output_dir, f"{name}.csv")
+    return os.path.getmtime(path) if os.path.exists(path) else None
+
+def scan_output(output_dir: str, name: str, months: list | None = None) -> pl.LazyFrame | None:
+    """
+    Scans an output written by OutputWriter, falling back to a plain CSV from older runs.
+    `months` ('YYYY-MM') restricts a partitioned dataset to those partitions, or the rows
+    of those months when it was written as one file.
+    """
+    entry = ((read_manifest(output_dir) or {}).get('outputs') or {}).get(name)
+    if entry is None or entry['partitions'] is None:
+        path = os.path.join(output_dir, entry['path'] if entry else f"{name}.csv")
+        if not os.path.exists(path):
+            return None
+        lf = conform(name, _scan_files(name, [path], entry['format'] if entry else 'csv'))
+        return lf.filter(month_key(PARTITIONS[name]).is_in(months)) if months is not None and name in PARTITIONS else lf
+
+    path = os.path.join(output_dir, entry['path'])
+    keys = entry['partitions'] if months is None else [m for m in months if m in entry['partitions']]
+    files = [f for key in keys for f in glob.glob(os.path.join(path, f"year_month={key}", "*"))]
+    if not files:
+        # none of the requested months exist, keep the schema
+        return conform(name, _scan_files(name, glob.glob(os.path.join(path, "*", "*"))[:1], entry['format']).head(0))
+    return conform(name, _scan_files(name, files, entry['format']))
@@ -0,0 +1,191 @@
+# postal_codes.py
+import polars as pl
+import urllib.request
+import urllib.error
+import zipfile
+import hashlib
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+POSTAL_URLS = {
+    "SK":"https://github.com/zauberware/postal-codes-json-xml-csv/raw/master/data/SK.zip",
+    "CZ":"https://github.com/zauberware/postal-codes-json-xml-csv/raw/master/data/CZ.zip",
+    "HU":"https://github.com/zauberware/postal-codes-json-xml-csv/raw/master/data/HU.zip"
+}
+
+# city -> place name prefixes (case-insensitive) of its districts and suburbs
+CITY_ALIASES = {
+    "Bratislava": ["Bratislava", "Pressburg"],
+    "Košice": ["Košice", "Kosice"],
+    "Praha": ["Praha", "Prague"],
+    "Brno": ["Brno"],
+    "Budapest": ["Budapest"]
+}
+
+# -----------------------------
+# 1. Parse postal code ZIP
+# -----------------------------
+def read_postal_zip(path: str, country_code: str) -> pl.DataFrame:
+    with zipfile.ZipFile(path) as z:
+        csv_files = [f for f in z.namelist() if f.endswith(".csv")]
+        if not csv_files:
+            raise ValueError(f"No CSV found in ZIP for {country_code}")
+        with z.open(csv_files[0]) as f:
+            df = pl.read_csv(f)
+
+    df = df.select(['zipcode', 'place', 'latitude', 'longitude'])
+    df = df.with_columns([
+        pl.col('zipcode').cast(pl.Utf8).str.replace_all(" ", "").str.zfill(5).alias('postal_code'),
+        pl.col('place').fill_null('Unknown').alias('place_name'),
+        pl.col('latitude').cast(pl.Float64),
+        pl.col('longitude').cast(pl.Float64),
+        pl.lit(country_code).alias('country_code')
+    ])
+
+    df_unique = df.group_by('postal_code', maintain_order=True).agg([
+        pl.first('place_name'),
+        pl.first('latitude'),
+        pl.first('longitude'),
+        pl.first('country_code')
+    ])
+    return df_unique
+
+# -----------------------------
+# 2. On-disk reference data cache
+# -----------------------------
+def _manifest_path(cache_dir: str, country_code: str) -> str:
+    return os.path.join(cache_dir, f"{country_code}.json")
+
+def _read_manifest(cache_dir: str, country_code: str) -> dict:
+    path = _manifest_path(cache_dir, country_code)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def _write_manifest(cache_dir: str, country_code: str, manifest: dict):
+    tmp = _manifest_path(cache_dir, country_code) + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, _manifest_path(cache_dir, country_code))
+
+def _is_usable(manifest: dict, url: str, cache_dir: str) -> bool:
+    return manifest.get('url') == url and os.path.exists(os.path.join(cache_dir, manifest.get('parquet', '')))
+
+def download_postal_codes_github(url: str, country_code: str, cache_dir: str, manifest: dict) -> dict:
+    """
+    Refreshes one country. Sends the cached ETag / Last-Modified so an unchanged
+    archive costs a 304, and streams the ZIP to disk instead of holding it in memory.
+    Returns the updated manifest.
+    """
+    request = urllib.request.Request(url)
+    if manifest.get('url') == url:
+        if manifest.get('etag'):
+            request.add_header('If-None-Match', manifest['etag'])
+        if manifest.get('last_modified'):
+            request.add_header('If-Modified-Since', manifest['last_modified'])
+
+    try:
+        response = urllib.request.urlopen(request, timeout=60)
+    except urllib.error.HTTPError as e:
+        if e.code == 304 and _is_usable(manifest, url, cache_dir):
+            return {**manifest, 'fetched_at': time.time()}
+        raise
+
+    sha = hashlib.sha256()
+    with response, tempfile.NamedTemporaryFile(dir=cache_dir, suffix=".zip", delete=False) as tmp:
+        for chunk in iter(lambda: response.read(1 << 20), b""):
+            sha.update(chunk)
+            tmp.write(chunk)
+    content_hash = sha.hexdigest()
+
+    # content-addressed: an unchanged archive served without ETag support is not re-parsed
+    parquet = f"{country_code}-{hashlib.sha256(url.encode()).hexdigest()[:8]}-{content_hash[:16]}.parquet"
+    try:
+        if not os.path.exists(os.path.join(cache_dir, parquet)):
+            read_postal_zip(tmp.name, country_code).write_parquet(os.path.join(cache_dir, parquet))
+    finally:
+        os.remove(tmp.name)
+
+    old = manifest.get('parquet')
+    if old and old != parquet and os.path.exists(os.path.join(cache_dir, old)):
+        os.remove(os.path.join(cache_dir, old))
+
+    return {
+        'url': url,
+        'country_code': country_code,
+        'content_sha256': content_hash,
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'parquet': parquet,
+        'fetched_at': time.time()
+    }
+
+def load_postal_codes(
+    urls: dict = POSTAL_URLS,
+    cache_dir: str = "../data/cache/postal_codes",
+    ttl_hours: float = 24 * 7,
+    offline: bool = False
+) -> pl.DataFrame:
+    """
+    Returns the deduplicated postal code table for all countries in `urls`.
+    Cached Parquet files younger than `ttl_hours` are used as is; stale ones are
+    revalidated concurrently. With offline=True the network is never touched and
+    a missing cache entry is an error.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    manifests = {c: _read_manifest(cache_dir, c) for c in urls}
+
+    stale = {}
+    for c, url in urls.items():
+        manifest = manifests[c]
+        if offline:
+            if not _is_usable(manifest, url, cache_dir):
+                raise FileNotFoundError(f"No cached postal codes for {c} in {cache_dir} (offline mode)")
+        elif not _is_usable(manifest, url, cache_dir) or time.time() - manifest['fetched_at'] > ttl_hours * 3600:
+            stale[c] = url
+
+    if stale:
+        with ThreadPoolExecutor(max_workers=len(stale)) as pool:
+            futures = {c: pool.submit(download_postal_codes_github, url, c, cache_dir, manifests[c]) for c, url in stale.items()}
+        for c, future in futures.items():
+            try:
+                manifests[c] = future.result()
+            except (urllib.error.URLError, OSError) as e:
+                if not _is_usable(manifests[c], urls[c], cache_dir):
+                    raise
+                print(f"Postal codes for {c} could not be refreshed ({e}), using cached copy.")
+                continue
+            _write_manifest(cache_dir, c, manifests[c])
+
+    return pl.concat([pl.read_parquet(os.path.join(cache_dir, manifests[c]['parquet'])) for c in urls])
+
+# -----------------------------
+# 3. City name normalization
+# -----------------------------
+def normalize_place_names(df, aliases: dict = CITY_ALIASES):
+    """
+    Maps place names starting with an alias (e.g. "Praha 4", "Bratislava - Petržalka") to
+    their city and returns place_name as Categorical. Works on DataFrames and LazyFrames.
+
+    All aliases are matched in one regex over the unique place names (longest alias first),
+    and the mapping is joined back, so the cost doesn't grow with the rows times the aliases.
+    """
+    lookup = {alias.lower(): city for city, city_aliases in aliases.items() for alias in city_aliases}
+    if not lookup:
+        return df.with_columns(pl.col('place_name').cast(pl.Categorical))
+    pattern = "^(" + "|".join(pl.escape_regex(a) for a in sorted(lookup, key=len, reverse=True)) + ")"
+
+    names = df.select(pl.col('place_name').unique())
+    mapping = names.with_columns(
+        pl.col('place_name').str.to_lowercase().str.extract(pattern, 1)
+          .replace_strict(lookup, default=None, return_dtype=pl.Utf8)
+          .fill_null(pl.col('place_name'))
+          .cast(pl.Categorical)
+          .alias('city')
+    )
+    return df.join(mapping, on='place_name', how='left', nulls_equal=True, maintain_order='left') \
+             .with_columns(pl.col('city').alias('place_name')).drop('city')
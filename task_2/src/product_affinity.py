@@ -0,0 +1,206 @@
+# product_affinity.py
+import polars as pl
+
+# -----------------------------
+# 1. Exact co-occurrence engine
+# -----------------------------
+def co_occurrence(lines, top_k: int = 10, min_support: float = 0.0, max_basket_size: int | None = None):
+    """
+    Counts item pairs bought together over a (fk_sales_order, fk_item) frame.
+    Works on both DataFrames and LazyFrames.
+
+    Items are mapped to dense integer ids, each basket is deduplicated and pairs are
+    produced with a self-join on the order key. Items below `min_support` are pruned
+    before the join (a pair can't be more frequent than either item) and baskets with
+    more than `max_basket_size` distinct items are skipped.
+    Returns the top_k pairs with count, support, confidence in both directions and lift.
+    """
+    total = lines.select(pl.col('fk_sales_order').n_unique().alias('total_orders'))
+
+    baskets = lines.select(['fk_sales_order', 'fk_item']).drop_nulls().unique()
+    if max_basket_size is not None:
+        baskets = baskets.filter(pl.len().over('fk_sales_order') <= max_basket_size)
+
+    items = baskets.group_by('fk_item').agg(pl.len().alias('item_count')) \
+                   .join(total, how='cross') \
+                   .filter(pl.col('item_count') >= min_support * pl.col('total_orders')) \
+                   .sort('fk_item').with_row_index('item_id') \
+                   .select(['item_id', 'fk_item', 'item_count'])
+
+    coded = baskets.join(items.select(['fk_item', 'item_id']), on='fk_item', how='inner') \
+                   .select([pl.col('fk_sales_order').rank('dense').alias('order_id'), 'item_id'])
+    pairs = coded.join(coded, on='order_id', suffix='_2').filter(pl.col('item_id') < pl.col('item_id_2'))
+
+    top_pairs = pairs.group_by(['item_id', 'item_id_2']).agg(pl.len().alias('count')) \
+                     .join(total, how='cross') \
+                     .filter(pl.col('count') >= min_support * pl.col('total_orders')) \
+                     .sort(['count', 'item_id', 'item_id_2'], descending=[True, False, False]).head(top_k)
+
+    return with_pair_metrics(top_pairs, items)
+
+def with_pair_metrics(pairs, items):
+    """Decodes item ids and adds support, confidence and lift to (item_id, item_id_2, count, total_orders)."""
+    items_2 = items.rename({'item_id': 'item_id_2', 'fk_item': 'fk_item_2', 'item_count': 'item_count_2'})
+    pairs = pairs.join(items, on='item_id', how='left').join(items_2, on='item_id_2', how='left')
+
+    return pairs.sort(['count', 'fk_item', 'fk_item_2'], descending=[True, False, False]).select([
+        pl.col('fk_item').alias('product_1'),
+        pl.col('fk_item_2').alias('product_2'),
+        pl.col('count'),
+        (pl.col('count') / pl.col('total_orders') * 100).alias('percent_of_orders'),
+        (pl.col('count') / pl.col('total_orders')).alias('support'),
+        (pl.col('count') / pl.col('item_count')).alias('confidence_1_2'),
+        (pl.col('count') / pl.col('item_count_2')).alias('confidence_2_1'),
+        (pl.col('count') * pl.col('total_orders') / (pl.col('item_count') * pl.col('item_count_2'))).alias('lift')
+    ])
+
+# -----------------------------
+# 2. Bounded-memory approximate mode
+# -----------------------------
+ITEMSET_KEYS = ['item_id', 'item_id_2', 'item_id_3']
+
+def _chunk(lines, i: int, n_chunks: int):
+    # chunks partition whole orders, so every basket is seen exactly once
+    return lines.filter(pl.col('fk_sales_order').hash(seed=0) % n_chunks == i).select(['fk_sales_order', 'fk_item'])
+
+def _baskets(chunk, max_basket_size: int | None):
+    baskets = chunk.drop_nulls().unique()
+    if max_basket_size is not None:
+        baskets = baskets.filter(pl.len().over('fk_sales_order') <= max_basket_size)
+    return baskets
+
+def _itemset_counts(coded, size: int):
+    keys = ITEMSET_KEYS[:size]
+    sets = coded
+    for i in range(1, size):
+        sets = sets.join(coded.rename({'item_id': keys[i]}), on='fk_sales_order') \
+                   .filter(pl.col(keys[i - 1]) < pl.col(keys[i]))
+    return sets.group_by(keys).agg(pl.len().alias('count'))
+
+def _merge_summary(summary: pl.DataFrame, counts: pl.DataFrame, keys: list, capacity: int):
+    """
+    Misra-Gries merge: add the chunk's exact counts, then keep at most `capacity`
+    counters by subtracting the (capacity+1)-th largest count from all of them.
+    Returns the new summary and the amount subtracted.
+    """
+    merged = pl.concat([summary, counts]).group_by(keys).agg(pl.sum('count'))
+    if merged.height <= capacity:
+        return merged, 0
+    threshold = int(merged['count'].top_k(capacity + 1).min())
+    merged = merged.with_columns(pl.col('count') - threshold).filter(pl.col('count') > 0)
+    return merged, threshold
+
+def frequent_itemsets_streaming(
+    lines,
+    top_k: int = 10,
+    size: int = 2,
+    capacity: int = 10_000,
+    n_chunks: int = 16,
+    min_support: float = 0.0,
+    max_basket_size: int | None = None,
+    verify: bool = True
+) -> pl.DataFrame:
+    """
+    Approximate top_k frequent pairs (size=2) or triples (size=3) in bounded memory.
+
+    Orders are processed in `n_chunks` hash partitions and the itemset counts are kept
+    in a Misra-Gries summary with at most `capacity` counters. A sketched count
+    undercounts by at most `error_bound` (the total subtracted, <= itemsets/(capacity+1)),
+    so every itemset more frequent than that is guaranteed to be a candidate.
+    With verify=True the candidates are re-counted exactly in a final pass.
+    Peak memory is one chunk's itemsets plus the summary, at the cost of re-reading the input per pass.
+    `lines` can also be a list of frames that already partition whole orders (such as the
+    spill partitions of the streaming mode); they are used as the chunks, read once per pass.
+    """
+    if isinstance(lines, list):
+        chunks = [part.lazy().select(['fk_sales_order', 'fk_item']) for part in lines]
+    else:
+        chunks = [_chunk(lines.lazy(), i, n_chunks) for i in range(n_chunks)]
+    keys = ITEMSET_KEYS[:size]
+
+    # pass 1: exact item counts and order total (catalogue-sized state)
+    item_counts, total_orders = [], 0
+    for chunk in chunks:
+        chunk = chunk.collect()
+        total_orders += chunk['fk_sales_order'].n_unique()
+        item_counts.append(_baskets(chunk, max_basket_size).group_by('fk_item').agg(pl.len().alias('item_count')))
+    items = pl.concat(item_counts).group_by('fk_item').agg(pl.sum('item_count')) \
+              .filter(pl.col('item_count') >= min_support * total_orders) \
+              .sort('fk_item').with_row_index('item_id') \
+              .select(['item_id', 'fk_item', 'item_count'])
+
+    def coded_chunk(chunk):
+        return _baskets(chunk, max_basket_size) \
+                   .join(items.lazy().select(['fk_item', 'item_id']), on='fk_item', how='inner') \
+                   .select(['fk_sales_order', 'item_id'])
+
+    # pass 2: sketch
+    summary = pl.DataFrame(schema={**{k: pl.UInt32 for k in keys}, 'count': pl.Int64})
+    error_bound = 0
+    for chunk in chunks:
+        counts = _itemset_counts(coded_chunk(chunk), size).collect()
+        summary, subtracted = _merge_summary(summary, counts.cast(summary.schema), keys, capacity)
+        error_bound += subtracted
+
+    # pass 3: exact re-count of the surviving candidates
+    if verify:
+        exact = [
+            _itemset_counts(coded_chunk(chunk), size).join(summary.lazy().select(keys), on=keys, how='semi').collect()
+            for chunk in chunks
+        ]
+        summary = pl.concat(exact).cast(summary.schema).group_by(keys).agg(pl.sum('count'))
+
+    top = summary.filter(pl.col('count') >= min_support * total_orders) \
+                 .sort(['count'] + keys, descending=[True] + [False] * size).head(top_k) \
+                 .with_columns(pl.lit(total_orders).alias('total_orders'))
+
+    if size == 2:
+        result = with_pair_metrics(top, items)
+    else:
+        for i, key in enumerate(keys):
+            top = top.join(items.select([pl.col('item_id').alias(key), pl.col('fk_item').alias(f'product_{i + 1}')]), on=key, how='left')
+        result = top.sort(['count'] + keys, descending=[True] + [False] * size).select(
+            [f'product_{i + 1}' for i in range(size)] + [
+                pl.col('count'),
+                (pl.col('count') / pl.col('total_orders') * 100).alias('percent_of_orders'),
+                (pl.col('count') / pl.col('total_orders')).alias('support')
+            ]
+        )
+    return result.with_columns([
+        pl.lit(error_bound).alias('error_bound'),
+        pl.lit(verify).alias('verified')
+    ])
+
+# -----------------------------
+# 3. Mergeable pair counts
+# -----------------------------
+def pair_counts(lines, max_basket_size: int | None = None):
+    """
+    Exact pair state of a set of whole baskets (e.g. one shard of the orders): all pair
+    counts, item counts and the number of orders. States of disjoint shards merge by summing.
+    """
+    lines = lines.lazy().with_columns(pl.col('fk_item').cast(pl.Utf8))
+    baskets = _baskets(lines.select(['fk_sales_order', 'fk_item']), max_basket_size)
+    items = baskets.group_by('fk_item').agg(pl.len().alias('item_count'))
+    pairs = baskets.join(baskets, on='fk_sales_order', suffix='_2') \
+                   .filter(pl.col('fk_item') < pl.col('fk_item_2')) \
+                   .group_by(['fk_item', 'fk_item_2']).agg(pl.len().alias('count'))
+    total = lines.select(pl.col('fk_sales_order').n_unique().alias('total_orders'))
+    pairs, items, total = pl.collect_all([pairs, items, total])
+    return pairs, items, total.item()
+
+def merge_pair_counts(states: list, top_k: int = 10, min_support: float = 0.0) -> pl.DataFrame:
+    """Top_k pairs from the pair_counts states of disjoint shards, same result as co_occurrence over all of them."""
+    total_orders = sum(total for _, _, total in states)
+    items = pl.concat([items for _, items, _ in states]).group_by('fk_item').agg(pl.sum('item_count')) \
+              .filter(pl.col('item_count') >= min_support * total_orders) \
+              .sort('fk_item').with_row_index('item_id') \
+              .select(['item_id', 'fk_item', 'item_count'])
+    ids = items.select(['fk_item', 'item_id'])
+    pairs = pl.concat([pairs for pairs, _, _ in states]).group_by(['fk_item', 'fk_item_2']).agg(pl.sum('count')) \
+              .join(ids, on='fk_item', how='inner') \
+              .join(ids.rename({'fk_item': 'fk_item_2', 'item_id': 'item_id_2'}), on='fk_item_2', how='inner') \
+              .filter(pl.col('count') >= min_support * total_orders) \
+              .sort(['count', 'item_id', 'item_id_2'], descending=[True, False, False]).head(top_k) \
+              .select(['item_id', 'item_id_2', 'count', pl.lit(total_orders).alias('total_orders')])
+    return with_pair_metrics(pairs, items)
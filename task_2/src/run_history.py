@@ -0,0 +1,178 @@
+# run_history.py
+import numpy as np
+import argparse
+import json
+import os
+import sqlite3
+import sys
+
+HISTORY_FILE = "run_history.sqlite"
+SPARK = "▁▂▃▄▅▆▇█"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started_at REAL NOT NULL,
+    finished_at REAL,
+    status TEXT,
+    wall_s REAL,
+    input_bytes INTEGER,
+    params TEXT
+);
+CREATE TABLE IF NOT EXISTS task_runs (
+    run_id INTEGER NOT NULL REFERENCES runs(run_id),
+    task TEXT NOT NULL,
+    status TEXT,
+    started_at REAL,
+    wall_s REAL,
+    cpu_s REAL,
+    peak_rss_mb REAL,
+    rows_in INTEGER,
+    rows_out INTEGER,
+    bytes_written INTEGER,
+    input_bytes INTEGER
+);
+CREATE INDEX IF NOT EXISTS task_runs_task ON task_runs (task, started_at);
+"""
+
+# -----------------------------
+# 1. Store
+# -----------------------------
+def connect(db_path: str) -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    con = sqlite3.connect(db_path)
+    con.executescript(SCHEMA)
+    if 'input_bytes' not in [c[1] for c in con.execute("PRAGMA table_info(task_runs)")]:
+        # history written before tasks declared their input volume
+        con.execute("ALTER TABLE task_runs ADD COLUMN input_bytes INTEGER")
+    return con
+
+def record_run(db_path: str, metrics: dict, input_bytes: int | None = None, params: dict | None = None) -> int:
+    """Appends a run's task metrics (as written by instrumentation) to the history. Cached tasks are skipped."""
+    with connect(db_path) as con:
+        run_id = con.execute(
+            "INSERT INTO runs (started_at, finished_at, status, wall_s, input_bytes, params) VALUES (?, ?, ?, ?, ?, ?)",
+            (metrics['started_at'], metrics['finished_at'], metrics['status'], metrics['wall_s'], input_bytes,
+             json.dumps(params, default=str) if params else None)
+        ).lastrowid
+        con.executemany(
+            """INSERT INTO task_runs (run_id, task, status, started_at, wall_s, cpu_s, peak_rss_mb,
+                                       rows_in, rows_out, bytes_written, input_bytes)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            [(run_id, t['task'], t['status'], t['started_at'], t['wall_s'], t['cpu_s'], t['peak_rss_mb'],
+              t['rows_in'], t['rows_out'], t['bytes_written'], t.get('input_bytes'))
+             for t in metrics['tasks'] if t['status'] != 'cached']
+        )
+    return run_id
+
+def task_history(db_path: str, last: int = 30) -> dict:
+    """task -> (wall_s, volume) arrays of its last successful runs, oldest first."""
+    with connect(db_path) as con:
+        rows = con.execute("""
+            SELECT task, wall_s, rows_in, task_bytes, input_bytes FROM (
+                SELECT t.task, t.wall_s, t.rows_in, t.input_bytes AS task_bytes, r.input_bytes, t.started_at,
+                       ROW_NUMBER() OVER (PARTITION BY t.task ORDER BY t.started_at DESC) AS n
+                FROM task_runs t JOIN runs r USING (run_id)
+                WHERE t.status = 'ok'
+            ) WHERE n <= ? ORDER BY task, started_at
+        """, (last,)).fetchall()
+
+    history = {}
+    for task, wall_s, rows_in, task_bytes, input_bytes in rows:
+        history.setdefault(task, []).append((wall_s, rows_in, task_bytes, input_bytes))
+    result = {}
+    for task, runs in history.items():
+        wall = np.array([r[0] for r in runs], dtype=np.float64)
+        # the volume the task declares: rows of its input frames or size of the files it reads;
+        # the run's input files for runs recorded before tasks declared one
+        if all(r[1] for r in runs):
+            volume = [r[1] for r in runs]
+        elif all(r[2] for r in runs):
+            volume = [r[2] for r in runs]
+        else:
+            volume = [r[3] for r in runs]
+        result[task] = (wall, np.array([v or np.nan for v in volume], dtype=np.float64))
+    return result
+
+# -----------------------------
+# 2. Growth detection
+# -----------------------------
+def growth(wall: np.ndarray, volume: np.ndarray, min_runs: int = 3, min_volume_spread: float = 1.2) -> dict:
+    """
+    exponent: slope of log(runtime) over log(volume), ~1 for linear cost (needs the volume to vary).
+    cost_change: fitted change of runtime per unit of volume from the first to the last run;
+    above 1 the task got slower faster than its input grew.
+    """
+    ok = np.isfinite(volume) & (volume > 0) & (wall > 0)
+    wall, volume = wall[ok], volume[ok]
+    stats = {'runs': len(wall), 'exponent': None, 'cost_change': None}
+    if len(wall) < min_runs:
+        return stats
+    if volume.max() / volume.min() >= min_volume_spread:
+        stats['exponent'] = float(np.polyfit(np.log(volume), np.log(wall), 1)[0])
+    slope = np.polyfit(np.arange(len(wall)), np.log(wall / volume), 1)[0]
+    stats['cost_change'] = float(np.exp(slope * (len(wall) - 1)))
+    return stats
+
+def flags(stats: dict, max_exponent: float = 1.25, max_cost_change: float = 1.5) -> list:
+    found = []
+    if stats['exponent'] is not None and stats['exponent'] > max_exponent:
+        found.append(f"super-linear (runtime ~ volume^{stats['exponent']:.2f})")
+    if stats['cost_change'] is not None and stats['cost_change'] > max_cost_change:
+        found.append(f"runtime per unit of input up {stats['cost_change']:.1f}x")
+    return found
+
+def growth_warnings(db_path: str, last: int = 30, min_wall_s: float = 0.5, **thresholds) -> dict:
+    """task -> flags, for tasks whose recent runs take at least min_wall_s (shorter ones are noise)."""
+    warnings = {}
+    for task, (wall, volume) in task_history(db_path, last).items():
+        if np.median(wall) < min_wall_s:
+            continue
+        found = flags(growth(wall, volume), **thresholds)
+        if found:
+            warnings[task] = found
+    return warnings
+
+# -----------------------------
+# 3. CLI report
+# -----------------------------
+def sparkline(values: np.ndarray) -> str:
+    lo, hi = values.min(), values.max()
+    if hi == lo:
+        return SPARK[0] * len(values)
+    return "".join(SPARK[int((v - lo) / (hi - lo) * (len(SPARK) - 1))] for v in values)
+
+def print_report(db_path: str, last: int = 30, min_wall_s: float = 0.5, **thresholds) -> int:
+    """Prints the runtime trend of every task; returns the number of flagged tasks."""
+    history = task_history(db_path, last)
+    if not history:
+        print(f"No runs recorded in {db_path}")
+        return 0
+
+    print(f"{'task':<28}{'runs':>5}{'last s':>10}{'volume':>14}{'exponent':>10}{'cost chg':>10}  trend")
+    flagged = 0
+    for task, (wall, volume) in sorted(history.items()):
+        stats = growth(wall, volume)
+        found = flags(stats, **thresholds) if np.median(wall) >= min_wall_s else []
+        flagged += bool(found)
+        exponent = f"{stats['exponent']:.2f}" if stats['exponent'] is not None else "-"
+        cost = f"{stats['cost_change']:.2f}x" if stats['cost_change'] is not None else "-"
+        last_volume = f"{volume[-1]:,.0f}" if np.isfinite(volume[-1]) else "-"
+        print(f"{task:<28}{stats['runs']:>5}{wall[-1]:>10.2f}{last_volume:>14}{exponent:>10}{cost:>10}  {sparkline(wall)}")
+        for flag in found:
+            print(f"  ! {flag}")
+    return flagged
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runtime trends of the ETL tasks from the run history.")
+    parser.add_argument("--db", default=os.path.join("..", "data", "out", HISTORY_FILE))
+    parser.add_argument("--last", type=int, default=30, help="runs per task to analyse")
+    parser.add_argument("--min-wall-s", type=float, default=0.5, help="ignore tasks faster than this")
+    parser.add_argument("--max-exponent", type=float, default=1.25)
+    parser.add_argument("--max-cost-change", type=float, default=1.5)
+    parser.add_argument("--fail-on-flag", action="store_true", help="exit with 1 if a task is flagged")
+    args = parser.parse_args()
+
+    flagged = print_report(args.db, args.last, args.min_wall_s,
+                           max_exponent=args.max_exponent, max_cost_change=args.max_cost_change)
+    sys.exit(1 if flagged and args.fail_on_flag else 0)
@@ -0,0 +1,154 @@
+# spatial.py
+import numpy as np
+import polars as pl
+
+R = 6371
+KM_PER_DEGREE = 2 * np.pi * R / 360
+
+# map bin sizes precomputed for the dashboard
+MAP_BIN_KM = [2, 5, 10, 25, 50]
+# bin longitudes are scaled at the centre of SK/CZ/HU, so the cells are roughly square there
+BIN_REFERENCE_LATITUDE = 48.5
+
+# existing brick-and-mortar stores (city centre coordinates)
+DEFAULT_STORES = {
+    "Košice": (48.7164, 21.2611),
+    "Budapest": (47.4979, 19.0402),
+    "Praha": (50.0755, 14.4378)
+}
+
+# -----------------------------
+# 1. Distances
+# -----------------------------
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Vectorized haversine distance; arguments broadcast like numpy arrays."""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2)**2
+    return 2 * R * np.arcsin(np.sqrt(a))
+
+def stores_frame(stores: dict = DEFAULT_STORES) -> pl.DataFrame:
+    return pl.DataFrame({
+        'store': list(stores),
+        'store_latitude': [float(lat) for lat, lon in stores.values()],
+        'store_longitude': [float(lon) for lat, lon in stores.values()]
+    })
+
+# -----------------------------
+# 2. Grid index
+# -----------------------------
+class GridIndex:
+    """
+    Uniform lat/lon grid over a fixed set of points (e.g. postal code centroids)
+    for radius queries. Build once, query many times.
+    """
+    def __init__(self, lat, lon, cell_km: float = 50):
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.cell_lat = cell_km / KM_PER_DEGREE
+        # cells are at least cell_km wide even at the highest latitude in the set
+        max_lat = np.abs(self.lat).max() if len(self.lat) else 0
+        self.cell_lon = cell_km / (KM_PER_DEGREE * np.cos(np.radians(min(max_lat, 89))))
+
+        rows, cols = self._cell(self.lat, self.lon)
+        self.order = np.lexsort((cols, rows))
+        keys, starts = np.unique(np.stack([rows, cols], axis=1)[self.order], axis=0, return_index=True)
+        ends = np.append(starts[1:], len(self.order))
+        self.cells = {(r, c): (s, e) for (r, c), s, e in zip(keys.tolist(), starts, ends)}
+
+    def _cell(self, lat, lon):
+        return np.floor(lat / self.cell_lat).astype(np.int64), np.floor(lon / self.cell_lon).astype(np.int64)
+
+    def query_radius(self, lat: float, lon: float, radius_km: float) -> np.ndarray:
+        """Indices of all points within radius_km of (lat, lon)."""
+        row, col = self._cell(np.float64(lat), np.float64(lon))
+        d_row = int(np.ceil(radius_km / KM_PER_DEGREE / self.cell_lat))
+        # longitude span of the radius grows towards the poles, size it at the far edge
+        edge_lat = min(abs(lat) + radius_km / KM_PER_DEGREE, 89)
+        d_col = int(np.ceil(radius_km / (KM_PER_DEGREE * np.cos(np.radians(edge_lat))) / self.cell_lon))
+
+        slices = []
+        for r in range(row - d_row, row + d_row + 1):
+            for c in range(col - d_col, col + d_col + 1):
+                if (r, c) in self.cells:
+                    start, end = self.cells[(r, c)]
+                    slices.append(self.order[start:end])
+        if not slices:
+            return np.empty(0, dtype=np.int64)
+        candidates = np.concatenate(slices)
+        return candidates[haversine_km(lat, lon, self.lat[candidates], self.lon[candidates]) <= radius_km]
+
+    def coverage(self, lat, lon, radius_km: float):
+        """Sparse coverage matrix in CSR form: points within radius_km of each query point."""
+        neighbours = [self.query_radius(a, b, radius_km) for a, b in zip(lat, lon)]
+        indptr = np.zeros(len(neighbours) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(n) for n in neighbours])
+        indices = np.concatenate(neighbours) if neighbours else np.empty(0, dtype=np.int64)
+        return indptr, indices
+
+# -----------------------------
+# 3. Greedy facility location
+# -----------------------------
+def greedy_store_locations(
+    demand: pl.DataFrame,
+    sites: pl.DataFrame,
+    n_new: int = 5,
+    stores: dict = DEFAULT_STORES,
+    radius_km: float = 50
+) -> pl.DataFrame:
+    """
+    Picks n_new store sites one at a time, each maximizing the sales within radius_km
+    that are not yet covered by an existing or already chosen store.
+
+    demand: place_name, latitude, longitude, total_sales (e.g. sales per delivery location)
+    sites:  place_name, latitude, longitude (e.g. every postal code centroid)
+    """
+    demand = demand.drop_nulls(['latitude', 'longitude'])
+    sites = sites.drop_nulls(['latitude', 'longitude']).unique(['place_name', 'latitude', 'longitude'], maintain_order=True)
+    index = GridIndex(demand['latitude'].to_numpy(), demand['longitude'].to_numpy(), cell_km=radius_km)
+    sales = demand['total_sales'].fill_null(0).to_numpy().astype(np.float64)
+
+    uncovered = np.ones(len(sales), dtype=bool)
+    for lat, lon in stores.values():
+        uncovered[index.query_radius(lat, lon, radius_km)] = False
+
+    indptr, indices = index.coverage(sites['latitude'].to_numpy(), sites['longitude'].to_numpy(), radius_km)
+    picks, gains = [], []
+    for _ in range(min(n_new, sites.height)):
+        # reduceat over the CSR rows; the padding and mask handle sites with no demand in range
+        weights = np.append((sales * uncovered)[indices], 0)
+        gain = np.add.reduceat(weights, indptr[:-1]) * (np.diff(indptr) > 0)
+        best = int(np.argmax(gain))
+        if gain[best] <= 0:
+            break
+        picks.append(best)
+        gains.append(gain[best])
+        uncovered[indices[indptr[best]:indptr[best + 1]]] = False
+
+    return sites[picks].with_columns([
+        pl.Series('rank', range(1, len(picks) + 1)),
+        pl.Series('new_covered_sales', gains, dtype=pl.Float64),
+        pl.Series('cumulative_covered_sales', np.cumsum(gains), dtype=pl.Float64)
+    ]).select(['rank', 'place_name', 'latitude', 'longitude', 'new_covered_sales', 'cumulative_covered_sales'])
+
+# -----------------------------
+# 4. Map bins
+# -----------------------------
+def location_bins(locations, resolutions_km: list = MAP_BIN_KM):
+    """
+    Grid cell of every (place_name, latitude, longitude) at each resolution, as the cell
+    centre, so a map can draw one point per cell instead of one per delivery location.
+    Works on both DataFrames and LazyFrames.
+    """
+    lon_km = KM_PER_DEGREE * np.cos(np.radians(BIN_REFERENCE_LATITUDE))
+    locations = locations.select(['place_name', 'latitude', 'longitude']).unique() \
+                         .drop_nulls(['latitude', 'longitude'])
+    bins = []
+    for km in resolutions_km:
+        row = (pl.col('latitude') * KM_PER_DEGREE / km).floor()
+        col = (pl.col('longitude') * lon_km / km).floor()
+        bins.append(locations.with_columns([
+            pl.lit(km, dtype=pl.Float64).alias('resolution_km'),
+            ((row + 0.5) * km / KM_PER_DEGREE).alias('bin_latitude'),
+            ((col + 0.5) * km / lon_km).alias('bin_longitude')
+        ]))
+    return pl.concat(bins).sort(['resolution_km', 'bin_latitude', 'bin_longitude', 'place_name', 'latitude', 'longitude'])
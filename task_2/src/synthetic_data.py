@@ -0,0 +1,146 @@
+# synthetic_data.py
+import polars as pl
+import numpy as np
+import argparse
+import io
+import os
+import zipfile
+
+# country -> (share of orders, currency, EUR rate, postal code range, lat/lon box)
+COUNTRIES = {
+    "SK": (0.35, "EUR", 1.0, (1000, 99999), (47.8, 49.5, 17.0, 22.5)),
+    "CZ": (0.35, "CZK", 0.0397, (10000, 79999), (48.6, 51.0, 12.1, 18.8)),
+    "HU": (0.30, "HUF", 0.0025, (1000, 9999), (45.8, 48.5, 16.1, 22.8))
+}
+# a share of postal codes carry district names of the cities the ETL normalizes
+CITIES = {
+    "SK": ["Bratislava - Ružinov", "Bratislava - Petržalka", "Košice - Staré Mesto", "Žilina", "Nitra"],
+    "CZ": ["Praha 4", "Praha 10", "Brno-střed", "Ostrava", "Plzeň"],
+    "HU": ["Budapest XI. kerület", "Budapest XIII. kerület", "Debrecen", "Szeged", "Győr"]
+}
+POSTAL_CODES_PER_COUNTRY = 3000
+HEX = np.array([f"{i:02x}" for i in range(256)], dtype='S2')
+
+# -----------------------------
+# 1. Reference data
+# -----------------------------
+def postal_codes(seed: int = 0) -> pl.DataFrame:
+    """A fixed set of postal codes with places and coordinates per country."""
+    rng = np.random.default_rng(seed)
+    frames = []
+    for c, (_, _, _, (lo, hi), (lat0, lat1, lon0, lon1)) in COUNTRIES.items():
+        n = POSTAL_CODES_PER_COUNTRY
+        # about 4 postal codes per place, the first places are the larger cities
+        place = np.arange(n) // 4
+        frames.append(pl.DataFrame({
+            'country_code': [c] * n,
+            'zipcode': np.sort(rng.choice(np.arange(lo, hi), n, replace=False)),
+            'place': [CITIES[c][p] if p < len(CITIES[c]) else f"{c}-Obec-{p}" for p in place],
+            'latitude': rng.uniform(lat0, lat1, n).round(4),
+            'longitude': rng.uniform(lon0, lon1, n).round(4)
+        }))
+    return pl.concat(frames)
+
+def write_postal_fixture(fixture_dir: str, seed: int = 0) -> dict:
+    """Writes <country>.zip archives laid out like the GitHub postal code data; returns file:// URLs for them."""
+    os.makedirs(fixture_dir, exist_ok=True)
+    urls = {}
+    for (c,), df in postal_codes(seed).partition_by('country_code', as_dict=True).items():
+        path = os.path.abspath(os.path.join(fixture_dir, f"{c}.zip"))
+        buffer = io.StringIO()
+        df.write_csv(buffer)
+        with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+            z.writestr(f"{c}.csv", buffer.getvalue())
+        urls[c] = f"file://{path}"
+    return urls
+
+# -----------------------------
+# 2. Orders and items
+# -----------------------------
+def hex_ids(rng, n: int) -> np.ndarray:
+    """n random 32 character hex keys, like pk_sales_order / fk_item."""
+    return HEX[rng.integers(0, 256, size=(n, 16), dtype=np.uint8)].view('S32').ravel().astype('U32')
+
+def generate(
+    output_dir: str,
+    n_lines: int = 100_000,
+    n_products: int = 20_000,
+    mean_basket_size: float = 2.5,
+    start: str = "2024-01-01",
+    days: int = 365,
+    chunk_orders: int = 500_000,
+    seed: int = 0
+) -> tuple[str, str]:
+    """
+    Writes sales_order.csv and sales_order_item.csv with about n_lines order lines.
+
+    Basket sizes are geometric around mean_basket_size, product popularity is Zipf-like
+    and prices are log-normal in EUR, converted to the order currency. Orders are
+    generated and appended in chunks, so 10M+ lines fit in modest memory.
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(output_dir, exist_ok=True)
+    orders_path = os.path.join(output_dir, "sales_order.csv")
+    items_path = os.path.join(output_dir, "sales_order_item.csv")
+
+    products = hex_ids(rng, n_products)
+    popularity = 1 / np.arange(1, n_products + 1) ** 1.1
+    popularity /= popularity.sum()
+    price_eur = rng.lognormal(3.0, 0.8, n_products).round(2)
+    cost_eur = (price_eur * rng.uniform(0.4, 0.8, n_products)).round(2)
+
+    countries = list(COUNTRIES)
+    shares = np.array([COUNTRIES[c][0] for c in countries])
+    currency = np.array([COUNTRIES[c][1] for c in countries])
+    rate = np.array([COUNTRIES[c][2] for c in countries])
+    # the country's postal codes are consecutive in the reference table
+    zipcodes = postal_codes(seed)['zipcode'].to_numpy()
+    start_ts = np.datetime64(start, 'ms')
+
+    n_orders = max(1, round(n_lines / mean_basket_size))
+    n_written = 0
+    with open(orders_path, "w") as orders_file, open(items_path, "w") as items_file:
+        for offset in range(0, n_orders, chunk_orders):
+            n = min(chunk_orders, n_orders - offset)
+            order_ids = hex_ids(rng, n)
+            country = rng.choice(len(countries), n, p=shares)
+            postal_code = zipcodes[country * POSTAL_CODES_PER_COUNTRY + rng.integers(0, POSTAL_CODES_PER_COUNTRY, n)]
+            # order volume grows over the period
+            created_at = start_ts + (np.sqrt(rng.uniform(0, 1, n)) * days * 86_400_000).astype('timedelta64[ms]')
+
+            orders = pl.DataFrame({
+                'pk_sales_order': order_ids,
+                'created_at': pl.Series(created_at).dt.strftime("%Y-%m-%d %H:%M:%S.000"),
+                'currency': currency[country],
+                'currency_rate': rate[country],
+                'country_code': np.array(countries)[country],
+                'postal_code': postal_code
+            })
+
+            basket = rng.geometric(1 / mean_basket_size, n)
+            line_order = np.repeat(np.arange(n), basket)
+            product = rng.choice(n_products, len(line_order), p=popularity)
+            items = pl.DataFrame({
+                'fk_sales_order': order_ids[line_order],
+                'fk_item': products[product],
+                'product_price_local_currency': (price_eur[product] / rate[country[line_order]]).round(2),
+                'sold_qty': rng.geometric(0.7, len(line_order)),
+                'product_cost_eur': cost_eur[product]
+            })
+
+            orders.write_csv(orders_file, include_header=offset == 0)
+            items.write_csv(items_file, include_header=offset == 0)
+            n_written += items.height
+
+    print(f"Generated {n_orders:,} orders and {n_written:,} order lines in {output_dir}")
+    return orders_path, items_path
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generates synthetic sales_order / sales_order_item data.")
+    parser.add_argument("--lines", type=int, default=100_000)
+    parser.add_argument("--products", type=int, default=20_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output-dir", default="../data/bench/synthetic")
+    args = parser.parse_args()
+    generate(args.output_dir, args.lines, args.products, seed=args.seed)
+    write_postal_fixture(os.path.join(args.output_dir, "postal"), args.seed)